@@ -1,14 +1,111 @@
 import os
+import threading
+from contextlib import contextmanager
 from Config import Config
-from langchain_openai import ChatOpenAI
+from Agent.LLMCache import LLMCache
+from Metrics import metrics
 from langchain_core.prompts import ChatPromptTemplate
 
 config = Config()
 os.environ["OPENAI_API_KEY"] =  config.OPENAI_API_KEY
-llm = ChatOpenAI(model_name=config.gen_model, temperature=0)
+_llm = None
+_llm_lock = threading.Lock()
+_llm_cache = None
 
-def ask_agent(prompt, data):
+def get_llm():
+    """The shared ChatOpenAI client, created on first use instead of at import time."""
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            from langchain_openai import ChatOpenAI
+            _llm = ChatOpenAI(model_name=config.gen_model, temperature=0, stream_usage=True)
+        return _llm
+
+def get_llm_cache():
+    """The on-disk ask_agent response cache (None when config.llm_cache_path is None)."""
+    global _llm_cache
+    with _llm_lock:
+        if _llm_cache is None and config.llm_cache_path:
+            _llm_cache = LLMCache(config.llm_cache_path, config.gen_model)
+        return _llm_cache
+
+@contextmanager
+def uncache_on_error(prompt, data):
+    """Drop the cached response of (prompt, data) if parsing it inside the block raises, so a rerun doesn't replay it."""
+    try:
+        yield
+    except Exception:
+        cache = get_llm_cache()
+        if cache is not None:
+            cache.delete(prompt, data)
+        raise
+
+def format_messages(prompt, data):
     prompt = ChatPromptTemplate.from_messages([("system", prompt), ("human", "{input}")])
-    formatted = prompt.format_messages(input=data)
-    response = llm.invoke(formatted)
-    return response.content
\ No newline at end of file
+    return prompt.format_messages(input=data)
+
+def record_usage(kind, prompt, data, usage_metadata, completion, usage=None):
+    """Count the call's prompt/completion tokens (estimated if the API didn't report them)."""
+    usage_metadata = usage_metadata or {}
+    prompt_tokens = usage_metadata.get("input_tokens") or estimate_tokens(prompt) + estimate_tokens(data)
+    completion_tokens = usage_metadata.get("output_tokens") or estimate_tokens(completion)
+    metrics.inc("llm_calls_total", kind=kind)
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens, kind=kind)
+    metrics.inc("llm_completion_tokens_total", completion_tokens, kind=kind)
+    if usage is not None:
+        usage.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+def ask_agent(prompt, data):
+    cache = get_llm_cache()
+    if cache is not None:
+        cached = cache.get(prompt, data)
+        if cached is not None:
+            return cached
+    return invoke_agent(prompt, data)
+
+def invoke_agent(prompt, data):
+    """ask_agent without the cache lookup, for callers that already missed it. The response is still cached."""
+    formatted = format_messages(prompt, data)
+    response = get_llm().invoke(formatted)
+    record_usage("invoke", prompt, data, response.usage_metadata, response.content)
+    cache = get_llm_cache()
+    if cache is not None:
+        cache.put(prompt, data, response.content)
+    return response.content
+
+def stream_agent(prompt, data, usage=None):
+    """
+    Like ask_agent, but yields the answer piece by piece as the model generates it.
+    Pass a dict as `usage` to get the call's prompt_tokens / completion_tokens.
+    """
+    formatted = format_messages(prompt, data)
+    answer, usage_metadata = "", None
+    for chunk in get_llm().stream(formatted):
+        usage_metadata = chunk.usage_metadata or usage_metadata
+        if chunk.content:
+            answer += chunk.content
+            yield chunk.content
+    record_usage("stream", prompt, data, usage_metadata, answer, usage)
+
+def estimate_tokens(text):
+    """Rough token count (no tokenizer needed), used for rate limiting and batching."""
+    return len(text) // config.chars_per_token + 1
+
+
+async def aask_agent(prompt, data):
+    """Async ask_agent: awaits the model without holding a worker thread."""
+    formatted = format_messages(prompt, data)
+    response = await get_llm().ainvoke(formatted)
+    record_usage("invoke", prompt, data, response.usage_metadata, response.content)
+    return response.content
+
+async def astream_agent(prompt, data, usage=None):
+    """Async stream_agent."""
+    formatted = format_messages(prompt, data)
+    answer, usage_metadata = "", None
+    async for chunk in get_llm().astream(formatted):
+        usage_metadata = chunk.usage_metadata or usage_metadata
+        if chunk.content:
+            answer += chunk.content
+            yield chunk.content
+    record_usage("stream", prompt, data, usage_metadata, answer, usage)
\ No newline at end of file
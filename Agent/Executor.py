@@ -0,0 +1,105 @@
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from openai import BadRequestError
+from Config import Config
+from Agent.Agent import invoke_agent, estimate_tokens, get_llm_cache
+
+
+class RateLimiter:
+    """
+    Sliding one-minute window over requests and tokens.
+    Shared by all worker threads of an LLMExecutor.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, window_seconds=60):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds
+        self.lock = threading.Lock()
+        self.requests = deque()  # timestamps
+        self.tokens = deque()  # (timestamp, tokens), prompts and completions
+        self.used_tokens = 0
+
+    def _expire(self, now):
+        while self.requests and now - self.requests[0] >= self.window_seconds:
+            self.requests.popleft()
+        while self.tokens and now - self.tokens[0][0] >= self.window_seconds:
+            _, tokens = self.tokens.popleft()
+            self.used_tokens -= tokens
+
+    def acquire(self, tokens):
+        """Block until a request of `tokens` tokens fits in the current window."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._expire(now)
+                fits_requests = len(self.requests) < self.requests_per_minute
+                # A single oversized request is let through on an empty window
+                fits_tokens = not self.tokens or self.used_tokens + tokens <= self.tokens_per_minute
+                if fits_requests and fits_tokens:
+                    self.requests.append(now)
+                    self.tokens.append((now, tokens))
+                    self.used_tokens += tokens
+                    return
+                oldest = self.tokens[0][0] if fits_requests else self.requests[0]
+                wait = self.window_seconds - (now - oldest)
+            time.sleep(max(wait, 0.05))
+
+    def record(self, tokens):
+        """Charge tokens that are only known after the call (the completion); not a new request."""
+        with self.lock:
+            self.tokens.append((time.monotonic(), tokens))
+            self.used_tokens += tokens
+
+
+class LLMExecutor:
+    """
+    Runs many ask_agent calls at once on a thread pool, with request/token
+    rate limits and retries with exponential backoff.
+    """
+
+    def __init__(self, max_workers=None, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=None, backoff_seconds=None):
+        config = Config()
+        self.max_workers = max_workers or config.llm_max_workers
+        self.max_retries = config.llm_max_retries if max_retries is None else max_retries
+        self.backoff_seconds = backoff_seconds or config.llm_backoff_seconds
+        self.limiter = RateLimiter(
+            requests_per_minute or config.llm_requests_per_minute,
+            tokens_per_minute or config.llm_tokens_per_minute,
+        )
+
+    def call(self, prompt, data):
+        """Rate-limited ask_agent with retries. Safe to call from inside `map` workers."""
+        cache = get_llm_cache()
+        if cache is not None:
+            # Cached responses don't count against the rate limits
+            cached = cache.get(prompt, data)
+            if cached is not None:
+                return cached
+
+        self.limiter.acquire(estimate_tokens(prompt) + estimate_tokens(data))
+        attempt = 0
+        while True:
+            try:
+                response = invoke_agent(prompt, data)
+                self.limiter.record(estimate_tokens(response))
+                return response
+            except BadRequestError:
+                raise # e.g. context length exceeded, retrying the same input won't help
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = self.backoff_seconds * 2 ** (attempt - 1) * (1 + random.random())
+                print(f"LLM call failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                self.limiter.acquire(estimate_tokens(prompt) + estimate_tokens(data))
+
+    def map(self, fn, items):
+        """Apply fn to every item concurrently; results keep the order of items."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(fn, items))
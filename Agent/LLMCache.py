@@ -0,0 +1,49 @@
+import json
+import sqlite3
+import hashlib
+import threading
+from Metrics import metrics
+
+
+class LLMCache:
+    """
+    On-disk cache of ask_agent responses, keyed by a hash of the model, the
+    system prompt and the input. With temperature 0 the same call gives the same
+    answer, so a rerun of the preprocessing (e.g. after a crash) doesn't pay
+    for calls that already succeeded.
+    """
+
+    def __init__(self, path, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)")
+        self.db.commit()
+
+    def key(self, prompt, data):
+        payload = json.dumps([self.model, prompt, data], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, prompt, data):
+        with self.lock:
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (self.key(prompt, data),)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.inc("cache_requests_total", cache="llm", result="miss")
+                return None
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache="llm", result="hit")
+            return row[0]
+
+    def put(self, prompt, data, response):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (self.key(prompt, data), response))
+            self.db.commit()
+
+    def delete(self, prompt, data):
+        """Forget a response, e.g. one that could not be parsed, so the next call asks the model again."""
+        with self.lock:
+            self.db.execute("DELETE FROM responses WHERE key = ?", (self.key(prompt, data),))
+            self.db.commit()
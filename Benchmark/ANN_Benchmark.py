@@ -0,0 +1,94 @@
+"""
+Recall / latency / build time / size of the configurable vector index types
+on the real dataset, to pick Config.index_type and its parameters.
+
+    python -m Benchmark.ANN_Benchmark --k 30 --queries 500
+
+The summary of each sampled document is used as a query; the ground truth is
+an exact flat search over all document embeddings (read from the embedding cache).
+"""
+import time
+import argparse
+import faiss
+import numpy as np
+from Config import Config
+from RAG.VectorStore import VectorStore
+from RAG.IndexFactory import INDEX_TYPES, create_index, train_index, tune_index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", nargs="+", default=INDEX_TYPES, choices=INDEX_TYPES)
+    parser.add_argument("--k", type=int, default=30, help="neighbours per query (the retriever's fetch_k)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="IVF nprobe values to sweep")
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 128, 256], help="HNSW efSearch values to sweep")
+    parser.add_argument("--threads", type=int, default=1, help="FAISS threads while timing queries")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def build(config, embeddings):
+    start = time.perf_counter()
+    index = create_index(config, embeddings.shape[1], len(embeddings))
+    train_index(index, embeddings)
+    index.add(embeddings)
+    return index, time.perf_counter() - start
+
+def evaluate(index, queries, truth, k):
+    """recall@k against the exact neighbours plus per-query latency percentiles (ms)."""
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        _, found = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(found[0]) & set(expected))
+    return hits / truth.size, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def main():
+    args = parse_args()
+    faiss.omp_set_num_threads(args.threads)
+
+    v_store = VectorStore()
+    texts = [doc.page_content for doc in v_store.docs]
+    embeddings = np.ascontiguousarray(v_store.embed_documents(texts), dtype=np.float32)
+    k = min(args.k, len(texts))
+
+    rng = np.random.default_rng(args.seed)
+    sample = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+    summaries = [texts[i].split("\n\nConversation:\n")[0] for i in sample]
+    queries = np.asarray(v_store.embedding_function(summaries), dtype=np.float32)
+
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+
+    print(f"{len(texts)} documents, {len(queries)} queries, k={k}\n")
+    print(f"{'index':<10} {'param':<14} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8} {'size MB':>8}")
+
+    for index_type in args.types:
+        config = Config()
+        config.index_type = index_type
+        index, build_seconds = build(config, embeddings)
+        size_mb = faiss.serialize_index(index).nbytes / 2**20
+
+        if index_type == "hnsw":
+            sweep = [("efSearch", value) for value in args.ef_search]
+        elif index_type.startswith("ivf"):
+            sweep = [("nprobe", value) for value in args.nprobe]
+        else:
+            sweep = [("-", None)]
+
+        for name, value in sweep:
+            if name == "efSearch":
+                config.hnsw_ef_search = value
+            elif name == "nprobe":
+                config.ivf_nprobe = value
+            tune_index(index, config)
+
+            recall, p50, p99 = evaluate(index, queries, truth, k)
+            param = "-" if value is None else f"{name}={value}"
+            print(f"{index_type:<10} {param:<14} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f} {build_seconds:>8.2f} {size_mb:>8.2f}")
+
+if __name__ == "__main__":
+    main()
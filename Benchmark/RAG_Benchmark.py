@@ -0,0 +1,255 @@
+"""
+End-to-end latency / quality benchmark of the chat path on the saved index,
+with a deterministic local stand-in for the LLM, so it runs offline on a CPU box.
+
+    python -m Benchmark.RAG_Benchmark --queries queries.jsonl --concurrency 1 4 16
+
+queries.jsonl has one labelled query per line:
+    {"query": "...", "expected_doc_ids": ["venue-1f2e...", ...]}
+Without --queries, the summaries of --sample random indexed documents are used
+as queries, each labelled with its own document.
+
+Reports per-stage latency (query embedding, topic inference, FAISS + MMR search,
+prompt formatting, generation), recall against the expected documents,
+throughput of arag_answer at each concurrency level and memory use.
+The embedding model must already be in the local Hugging Face cache.
+"""
+import os
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import io
+import time
+import json
+import asyncio
+import contextlib
+import hashlib
+import argparse
+import numpy as np
+import Agent.Agent
+import Agent.Executor
+import RAG.Generation
+from Agent.Agent import estimate_tokens
+from Agent.Prompts import rag_generative_prompt
+from RAG.VectorStore import VectorStore
+from RAG.Retrieval import Retrieval
+from RAG.EmbeddingBatcher import EmbeddingBatcher
+from RAG.Generation import RAG as RAGPipeline
+from RAG.ContextPacker import CONVERSATION_SEPARATOR
+
+STAGES = ["embed query", "topic inference", "faiss + mmr", "prompt formatting", "generation"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", help="labelled queries (JSONL); default: sampled document summaries")
+    parser.add_argument("--sample", type=int, default=200, help="queries to sample when --queries is not given")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--llm-first-token-ms", type=float, default=300, help="fake LLM delay before the first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100, help="fake LLM streaming rate (0 = no delay)")
+    parser.add_argument("--llm-answer-tokens", type=int, default=60)
+    parser.add_argument("--output", help="also write the results as JSON, to compare runs")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+class FakeLLM:
+    """
+    Deterministic stand-in for the chat model: the answer words are derived from
+    a hash of the prompt, the first one arrives after first_token_ms and the
+    rest stream at tokens_per_second.
+    """
+
+    def __init__(self, first_token_ms, tokens_per_second, answer_tokens):
+        self.first_token_seconds = first_token_ms / 1000
+        self.token_seconds = 1 / tokens_per_second if tokens_per_second else 0
+        self.answer_tokens = answer_tokens
+
+    def tokens(self, prompt, data):
+        digest = hashlib.sha1(f"{prompt}|{data}".encode("utf-8")).hexdigest()
+        return [f"{digest[i % 32:i % 32 + 4]} " for i in range(self.answer_tokens)]
+
+    def delays(self, n):
+        return [self.first_token_seconds] + [self.token_seconds] * (n - 1)
+
+    def ask_agent(self, prompt, data):
+        tokens = self.tokens(prompt, data)
+        time.sleep(sum(self.delays(len(tokens))))
+        return "".join(tokens)
+
+    invoke_agent = ask_agent
+
+    def usage(self, prompt, data, usage):
+        if usage is not None:
+            usage.update(prompt_tokens=estimate_tokens(prompt) + estimate_tokens(data), completion_tokens=self.answer_tokens)
+
+    def stream_agent(self, prompt, data, usage=None):
+        tokens = self.tokens(prompt, data)
+        for token, delay in zip(tokens, self.delays(len(tokens))):
+            time.sleep(delay)
+            yield token
+        self.usage(prompt, data, usage)
+
+    async def astream_agent(self, prompt, data, usage=None):
+        tokens = self.tokens(prompt, data)
+        for token, delay in zip(tokens, self.delays(len(tokens))):
+            await asyncio.sleep(delay)
+            yield token
+        self.usage(prompt, data, usage)
+
+    def install(self):
+        """Replace the model calls everywhere they were imported."""
+        for module in (Agent.Agent, Agent.Executor, RAG.Generation):
+            for name in ("ask_agent", "invoke_agent", "stream_agent", "astream_agent"):
+                if hasattr(module, name):
+                    setattr(module, name, getattr(self, name))
+
+
+def memory_mb():
+    """Resident memory of this process (peak resident memory without psutil)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except ImportError:
+            return float("nan")
+
+def load_queries(args, retrieval):
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    doc_ids = list(retrieval.vector_store.index_to_docstore_id.values())
+    rng = np.random.default_rng(args.seed)
+    sample = [doc_ids[i] for i in rng.choice(len(doc_ids), size=min(args.sample, len(doc_ids)), replace=False)]
+    return [
+        {"query": doc.page_content.split(CONVERSATION_SEPARATOR)[0], "expected_doc_ids": [doc.id]}
+        for doc in retrieval.get_docs(sample)
+    ]
+
+def run_stages(rag, query):
+    """One chat turn, stage by stage in the order of RAG.prepare. Returns (seconds per stage, retrieved ids)."""
+    timings = {}
+
+    start = time.perf_counter()
+    embedding = rag.embed_query(query)
+    timings["embed query"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    topics = rag.infer_topics(query)
+    timings["topic inference"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    docs_topic, docs_general = rag.search(query, topics=topics, embedding=embedding)
+    docs_general = rag.dedupe_docs(docs_topic, docs_general)
+    timings["faiss + mmr"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    passages_topic, passages_general = rag.context_packer.pack(docs_topic, docs_general)
+    final_prompt_input = rag_generative_prompt.format(
+        user_query=query,
+        context_topic=rag.context_prepration(passages_topic),
+        context_general=rag.context_prepration(passages_general)
+    )
+    timings["prompt formatting"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in RAG.Generation.stream_agent(prompt=final_prompt_input, data=query):
+        pass
+    timings["generation"] = time.perf_counter() - start
+
+    return timings, [doc.id for doc, _ in docs_topic + docs_general]
+
+async def run_concurrent(rag, queries, concurrency):
+    """
+    Answer every query through arag_answer with `concurrency` clients, each
+    sending its next query when the previous answer is complete.
+    Returns (queries per second, per-query latencies).
+    """
+    rag.max_concurrent_chats = concurrency
+    rag.max_queued_chats = concurrency
+    rag._semaphore = None
+    pending = list(reversed(queries))
+    latencies = []
+
+    async def client():
+        while pending:
+            query = pending.pop()
+            start = time.perf_counter()
+            async for _ in rag.arag_answer(query):
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # per-turn timing lines
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return len(queries) / (time.perf_counter() - start), latencies
+
+def ms(values, q):
+    return np.percentile(values, q) * 1000
+
+def main():
+    args = parse_args()
+    FakeLLM(args.llm_first_token_ms, args.llm_tokens_per_second, args.llm_answer_tokens).install()
+    results = {"memory_mb": {"start": memory_mb()}}
+
+    start = time.perf_counter()
+    v_store = VectorStore()
+    config = v_store.config
+    query_batcher = None
+    if config.query_embedding_batching:  # same as Main
+        query_batcher = EmbeddingBatcher(v_store.embedding_function, config.query_embedding_batch_size, config.query_embedding_max_wait_ms)
+    retrieval = Retrieval(v_store.load_vector_store(), v_store.load_topic_index(), v_store.load_metadata_index(), query_batcher)
+    rag = RAGPipeline(retrieval)  # no answer cache: every query goes through the whole path
+    v_store.warmup()
+    results["load_seconds"] = time.perf_counter() - start
+    results["memory_mb"]["loaded"] = memory_mb()
+
+    queries = load_queries(args, retrieval)
+    print(f"{len(queries)} queries, index of {retrieval.vector_store.index.ntotal} documents, "
+          f"loaded in {results['load_seconds']:.2f}s\n")
+
+    # 1. Per-stage latency and recall, one query at a time
+    stage_seconds = {stage: [] for stage in STAGES}
+    recalls, hits = [], 0
+    for item in queries:
+        timings, retrieved = run_stages(rag, item["query"])
+        for stage, seconds in timings.items():
+            stage_seconds[stage].append(seconds)
+        expected = set(item["expected_doc_ids"])
+        found = len(expected & set(retrieved))
+        recalls.append(found / len(expected) if expected else 1.0)
+        hits += found > 0
+
+    print(f"{'stage':<18} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    results["stages"] = {}
+    for stage, values in stage_seconds.items():
+        results["stages"][stage] = {"p50_ms": ms(values, 50), "p99_ms": ms(values, 99), "mean_ms": np.mean(values) * 1000}
+        print(f"{stage:<18} {ms(values, 50):>9.2f} {ms(values, 99):>9.2f} {np.mean(values) * 1000:>9.2f}")
+
+    k = retrieval.k // 2
+    results["recall"] = float(np.mean(recalls))
+    results["hit_rate"] = hits / len(queries)
+    print(f"\nrecall (up to {k} topic + {k} general docs) {results['recall']:.3f}, "
+          f"queries with an expected doc retrieved {results['hit_rate']:.3f}\n")
+
+    # 2. Throughput of the async serving path
+    print(f"{'concurrency':<12} {'queries/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    results["throughput"] = {}
+    for concurrency in args.concurrency:
+        qps, latencies = asyncio.run(run_concurrent(rag, [item["query"] for item in queries], concurrency))
+        results["throughput"][concurrency] = {"qps": qps, "p50_ms": ms(latencies, 50), "p99_ms": ms(latencies, 99)}
+        print(f"{concurrency:<12} {qps:>10.2f} {ms(latencies, 50):>9.1f} {ms(latencies, 99):>9.1f}")
+
+    results["memory_mb"]["end"] = memory_mb()
+    memory = results["memory_mb"]
+    print(f"\nmemory MB: start {memory['start']:.0f}, index loaded {memory['loaded']:.0f}, end {memory['end']:.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+
+if __name__ == "__main__":
+    main()
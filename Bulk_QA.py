@@ -0,0 +1,110 @@
+"""
+Answer a file of questions offline, without the Gradio UI.
+
+    python Bulk_QA.py questions.txt answers.jsonl
+
+The input is one question per line, or JSONL with a "query" (and optional "id")
+per line. Questions are embedded in large batches and retrieved with one
+batched index search per chunk, and answers are generated concurrently through
+the rate-limited LLMExecutor. Every answer is appended to the output JSONL as
+{"id", "query", "answer", "topics", "doc_ids"} (or "error"); rerunning with the
+same output skips the questions already answered and retries the failed ones.
+"""
+import os
+import json
+import time
+import argparse
+from Config import Config
+from Agent.Executor import LLMExecutor
+from RAG.VectorStore import VectorStore
+from RAG.Retrieval import Retrieval
+from RAG.Generation import RAG
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("queries", help="questions file (.txt, one per line, or .jsonl)")
+    parser.add_argument("output", help="answers JSONL (appended to; existing ids are skipped)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="questions embedded, searched and written together")
+    parser.add_argument("--embed-batch-size", type=int, default=128)
+    parser.add_argument("--workers", type=int, help="concurrent generation calls (default Config.llm_max_workers)")
+    return parser.parse_args()
+
+def read_queries(path):
+    """[(id, query)] in file order; ids default to the line number."""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                queries.append((str(item.get("id", line_number)), item["query"]))
+            else:
+                queries.append((str(line_number), line))
+    return queries
+
+def answered_ids(path):
+    """Ids answered in the output; failed rows and a line cut off by a crash are answered again."""
+    if not os.path.exists(path):
+        return set()
+    ids = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "answer" in row:
+                ids.add(row["id"])
+    return ids
+
+def answer_chunk(chunk, v_store, rag, executor, embed_batch_size):
+    """Embed, retrieve and answer one chunk of (id, query). Returns the result rows in chunk order."""
+    queries = [query for _, query in chunk]
+    embeddings = v_store.embed_queries(queries, batch_size=embed_batch_size)
+    prepared = rag.prepare_batch(queries, embeddings)
+
+    def generate(item):
+        (query_id, query), (final_prompt_input, topics, doc_ids) = item
+        row = {"id": query_id, "query": query, "topics": topics, "doc_ids": doc_ids}
+        try:
+            row["answer"] = executor.call(final_prompt_input, query)
+        except Exception as e:
+            row["error"] = str(e)
+        return row
+
+    return executor.map(generate, list(zip(chunk, prepared)))
+
+def main():
+    args = parse_args()
+    config = Config()
+    queries = read_queries(args.queries)
+    done = answered_ids(args.output)
+    pending = [(query_id, query) for query_id, query in queries if query_id not in done]
+    print(f"{len(queries)} questions, {len(queries) - len(pending)} already answered, {len(pending)} to go")
+    if not pending:
+        return
+
+    v_store = VectorStore()
+    retrieval = Retrieval(v_store.load_vector_store(), v_store.load_topic_index(), v_store.load_metadata_index())
+    rag = RAG(retrieval)
+    executor = LLMExecutor(max_workers=args.workers or config.llm_max_workers)
+
+    start = time.perf_counter()
+    answered, errors = 0, 0
+    with open(args.output, "a", encoding="utf-8") as out:
+        for i in range(0, len(pending), args.chunk_size):
+            rows = answer_chunk(pending[i:i + args.chunk_size], v_store, rag, executor, args.embed_batch_size)
+            for row in rows:
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+
+            answered += len(rows)
+            errors += sum("error" in row for row in rows)
+            elapsed = time.perf_counter() - start
+            print(f"{answered}/{len(pending)} answered ({errors} errors), {answered / elapsed:.1f} questions/s")
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,78 @@ class Config:
     def __init__(self):
         self.text_file_location = r'C:\Users\User\Documents\Wedplanner\TxtFiles'
         self.dataset = r'C:\Users\User\Documents\Wedplanner\dataset.csv'
+        self.ingest_state_path = r'C:\Users\User\Documents\Wedplanner\ingest_state.json'
         self.vector_store_path = r'C:\Users\User\Documents\Wedplanner\whatsapp_chat_faiss_cpu'
+        self.embedding_cache_path = r'C:\Users\User\Documents\Wedplanner\embedding_cache'
+        # Responses of every ask_agent call (None disables) and per-file stage outputs of an unfinished preprocessing run
+        self.llm_cache_path = r'C:\Users\User\Documents\Wedplanner\llm_cache.sqlite'
+        self.checkpoint_path = r'C:\Users\User\Documents\Wedplanner\checkpoints'
         self.OPENAI_API_KEY = "openai api key"
         self.gen_model = 'gpt-4o-mini'
-        self.embeded_model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
\ No newline at end of file
+        self.embeded_model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+        # Load the embedding model / LLM client in the background right after startup
+        self.preload_models = True
+
+        # Vector index: "flat", "hnsw", "ivf_flat", "ivf_pq" or "ivf_sq8"
+        # (compare them with Benchmark/ANN_Benchmark.py)
+        self.index_type = "flat"
+        self.hnsw_m = 32
+        self.hnsw_ef_construction = 200
+        self.hnsw_ef_search = 64
+        self.ivf_nlist = 256
+        self.ivf_nprobe = 16
+        self.pq_m = 48 # must divide the embedding dimension (384)
+        self.pq_nbits = 8
+        # The docstore (SQLite next to the index) is memory-mapped up to this size, shared by all serving processes
+        self.docstore_mmap_mb = 256
+
+        # Retrieval: the topic section searches the query's best matching topics (up to this many)
+        self.max_query_topics = 3
+
+        # Generation prompt context: token budget for retrieved documents, max thread
+        # excerpt per document, and word-overlap ratio above which threads count as duplicates
+        self.context_token_budget = 3000
+        self.context_excerpt_tokens = 250
+        self.context_duplicate_threshold = 0.8
+
+        # Answer cache in front of rag_answer (answer_cache_path = None keeps it in memory only)
+        self.answer_cache_enabled = True
+        self.answer_cache_path = r'C:\Users\User\Documents\Wedplanner\answer_cache.sqlite'
+        self.answer_cache_size = 1000
+        self.answer_cache_ttl_seconds = 24 * 60 * 60
+        self.answer_cache_similarity = 0.95
+
+        # Metrics: Prometheus endpoint on metrics_host:metrics_port (None disables it) and the share of
+        # chat turns logged as JSON lines with their stage timings (to metrics_log_path, or stdout if None)
+        self.metrics_host = "127.0.0.1" # "0.0.0.0" to let a Prometheus server on another machine scrape it
+        self.metrics_port = 9464
+        self.metrics_sample_rate = 0.05
+        self.metrics_log_path = None
+
+        # Query embeddings of concurrent chats are encoded together: a batch waits at most
+        # query_embedding_max_wait_ms for up to query_embedding_batch_size queries
+        self.query_embedding_batching = True
+        self.query_embedding_batch_size = 32
+        self.query_embedding_max_wait_ms = 5
+
+        # Async serving limits
+        self.max_concurrent_chats = 32
+        self.max_queued_chats = 64
+        self.serving_cpu_workers = 4
+
+        # LLM executor used by the preprocessing stages
+        self.llm_max_workers = 8
+        self.llm_requests_per_minute = 500
+        self.llm_tokens_per_minute = 200000
+        self.llm_max_retries = 5
+        self.llm_backoff_seconds = 2
+        self.chars_per_token = 3
+
+        # Worker processes for parsing exports (None = one per CPU core)
+        self.parse_workers = None
+
+        # Token-aware batching (input tokens per LLM call)
+        self.classify_batch_tokens = 4000
+        self.classify_max_batch = 150
+        self.synthesis_batch_tokens = 8000
+        self.synthesis_max_batch = 40
\ No newline at end of file
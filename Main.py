@@ -1,19 +1,81 @@
+import time
+STARTED = time.perf_counter()
+
+import threading
+from contextlib import contextmanager
 import gradio as gr
 from RAG.Retrieval import *
 from RAG.Generation import *
 from RAG.VectorStore import *
+from RAG.AnswerCache import AnswerCache
+from RAG.EmbeddingBatcher import EmbeddingBatcher
+from Metrics import metrics
+
+class StartupTimer:
+    """Collects how long each startup phase takes and prints a report."""
+
+    def __init__(self):
+        self.phases = [("imports", time.perf_counter() - STARTED)]
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        print("Startup time by phase:")
+        for name, seconds in self.phases:
+            print(f"  {name:<22} {seconds:7.3f}s")
+        print(f"  {'total':<22} {time.perf_counter() - STARTED:7.3f}s")
 
 def main():
+    timer = StartupTimer()
     config = Config()
     v_store = VectorStore()
 
     if not os.path.exists(config.vector_store_path):
-        v_store.create_vector()
-    vectorstore = v_store.load_vector_store()
-    retrieval = Retrieval(vectorstore)
-    rag = RAG(retrieval)
+        # Only (re)building reads the dataset and needs the embedding model up front
+        with timer.phase("build vector index"):
+            v_store.create_vector()
+    with timer.phase("load vector index"):
+        vectorstore = v_store.load_vector_store()
+        topic_index = v_store.load_topic_index()
+        metadata_index = v_store.load_metadata_index()
+    query_batcher = None
+    if config.query_embedding_batching:
+        query_batcher = EmbeddingBatcher(
+            v_store.embedding_function,
+            max_batch_size=config.query_embedding_batch_size,
+            max_wait_ms=config.query_embedding_max_wait_ms,
+        )
+    retrieval = Retrieval(vectorstore, topic_index, metadata_index, query_batcher)
+
+    answer_cache = None
+    if config.answer_cache_enabled:
+        with timer.phase("load answer cache"):
+            answer_cache = AnswerCache(
+                max_entries=config.answer_cache_size,
+                ttl_seconds=config.answer_cache_ttl_seconds,
+                similarity_threshold=config.answer_cache_similarity,
+                index_version=v_store.index_version(),
+                path=config.answer_cache_path,
+            )
+    rag = RAG(retrieval, answer_cache)
     # --- Gradio UI ---
-    ui = gr.ChatInterface(rag.rag_answer, title="RAG Chatbot")
+    with timer.phase("build UI"):
+        ui = gr.ChatInterface(rag.arag_answer, title="RAG Chatbot")
+        # RAG.arag_answer enforces its own concurrency limit and backpressure
+        ui.queue(default_concurrency_limit=config.max_concurrent_chats + config.max_queued_chats)
+    timer.report()
+
+    if config.metrics_port:
+        metrics.serve(config.metrics_port, config.metrics_host)
+        print(f"Prometheus metrics on http://{config.metrics_host}:{config.metrics_port}/metrics")
+
+    if config.preload_models:
+        # Load the embedding model and LLM client off the startup path, before the first question
+        threading.Thread(target=lambda: (v_store.warmup(), get_llm()), daemon=True).start()
     ui.launch()
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+import json
+import time
+import uuid
+import random
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Config import Config
+
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+
+class Trace:
+    """
+    Timing of the stages of one chat turn or ingest run. Every span feeds the
+    stage_seconds histogram; sampled traces are also written as one JSON log
+    line with their span durations and fields.
+    """
+
+    def __init__(self, metrics, name, sampled):
+        self.metrics = metrics
+        self.name = name
+        self.sampled = sampled
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.fields = {}
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.metrics.observe("stage_seconds", seconds, trace=self.name, stage=stage)
+            self.spans[stage] = self.spans.get(stage, 0) + seconds
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self, **fields):
+        self.fields.update(fields)
+        total = time.perf_counter() - self.start
+        self.metrics.observe("trace_seconds", total, trace=self.name)
+        if self.sampled:
+            self.metrics.log(
+                self.name,
+                trace_id=self.trace_id,
+                total_ms=round(total * 1000, 2),
+                spans_ms={stage: round(seconds * 1000, 2) for stage, seconds in self.spans.items()},
+                **self.fields,
+            )
+
+
+class Metrics:
+    """
+    Process-wide counters and latency histograms, exported in the Prometheus
+    text format (metrics.serve starts a /metrics endpoint). Counters and
+    histograms are always updated (a dict update under a lock); only
+    sample_rate of the traces are logged as JSON lines.
+    """
+
+    def __init__(self, sample_rate, log_path=None):
+        self.sample_rate = sample_rate
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [buckets, bucket counts, sum, count]
+
+    @staticmethod
+    def labels_key(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, self.labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, self.labels_key(labels))] = value
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        """Add value (seconds by default buckets) to a histogram."""
+        key = (name, self.labels_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(histogram[0]):
+                if value <= bound:
+                    histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def trace(self, name, sampled=None):
+        """Start a Trace; by default it is logged with probability sample_rate."""
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        return Trace(self, name, sampled)
+
+    def log(self, event, **fields):
+        line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, ensure_ascii=False, default=str)
+        with self.lock:
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            else:
+                print(line)
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels) + "}"
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, (bounds, list(b), s, c)) for key, (bounds, b, s, c) in self.histograms.items())
+
+        declared = set()
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in values:
+                if name not in declared:
+                    lines.append(f"# TYPE {name} {kind}")
+                    declared.add(name)
+                lines.append(f"{name}{self.format_labels(labels)} {value}")
+        for (name, labels), (bounds, buckets, total, count) in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE {name} histogram")
+                declared.add(name)
+            for bound, bucket_count in zip(bounds, buckets):
+                lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {bucket_count}")
+            lines.append(f"{name}_bucket{self.format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Expose /metrics on host:port from a daemon thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # no access log per scrape
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+_config = Config()
+metrics = Metrics(_config.metrics_sample_rate, _config.metrics_log_path)
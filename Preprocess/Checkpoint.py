@@ -0,0 +1,68 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+
+
+def encode(obj):
+    if isinstance(obj, datetime):
+        return {"$datetime": obj.isoformat()}
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+def decode(obj):
+    if set(obj) == {"$datetime"}:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+def run_key(path, chat_state):
+    """Identifies one run over one export: the file as it is now and the watermark the run starts from."""
+    stat = os.stat(path)
+    watermark = [chat_state['last_time'], chat_state['hash']] if chat_state else None
+    payload = json.dumps([stat.st_size, stat.st_mtime_ns, watermark])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    """
+    Output of each preprocessing stage (parse, classify, aggregate, synthesize)
+    of one export, saved as JSON as soon as the stage finishes. A rerun with
+    the same run key (same file, same watermark) loads finished stages instead
+    of recomputing them; a different key discards them.
+    """
+
+    def __init__(self, root, file, key):
+        self.path = os.path.join(root, hashlib.sha1(file.encode("utf-8")).hexdigest()[:16])
+        key_path = os.path.join(self.path, "run.json")
+        if os.path.exists(key_path):
+            with open(key_path, "r", encoding="utf-8") as f:
+                if json.load(f).get("key") == key:
+                    return
+            shutil.rmtree(self.path)
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(key_path, "w", encoding="utf-8") as f:
+            json.dump({"file": file, "key": key}, f, ensure_ascii=False)
+
+    def load(self, stage):
+        stage_path = os.path.join(self.path, f"{stage}.json")
+        if not os.path.exists(stage_path):
+            return None
+        with open(stage_path, "r", encoding="utf-8") as f:
+            return json.load(f, object_hook=decode)
+
+    def save(self, stage, result):
+        stage_path = os.path.join(self.path, f"{stage}.json")
+        with open(stage_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, default=encode)
+        os.replace(stage_path + ".tmp", stage_path)
+
+    def run(self, stage, compute):
+        """The saved output of `stage`, or compute() saved for the next run."""
+        result = self.load(stage)
+        if result is None:
+            result = compute()
+            self.save(stage, result)
+        else:
+            print(f"Resuming from checkpoint: {stage}")
+        return result
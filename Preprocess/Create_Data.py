@@ -1,4 +1,6 @@
 import re
+import hashlib
+import itertools
 from datetime import datetime
 
 URL_REGEX = re.compile(r"(https?://\S+|www\.\S+)")
@@ -8,6 +10,21 @@ WHATSAPP_PATTERN = re.compile(
     r"\[(\d{2}/\d{2}/\d{4}), (\d{2}:\d{2}:\d{2})\] ~\s*(.*?): (.*)"
 )
 
+# Timestamp prefix of any export line (messages, media and system lines)
+LINE_TIME_PATTERN = re.compile(
+    r"\u200e?\[(\d{2}/\d{2}/\d{4}), (\d{2}:\d{2}:\d{2})\]"
+)
+
+def parse_time(date_str, time_str):
+    """
+    Build the datetime of a "dd/mm/yyyy", "HH:MM:SS" pair.
+    The patterns already guarantee the layout, so slicing is much faster than strptime.
+    """
+    return datetime(
+        int(date_str[6:10]), int(date_str[3:5]), int(date_str[0:2]),
+        int(time_str[0:2]), int(time_str[3:5]), int(time_str[6:8])
+    )
+
 def clean_text(msg: str) -> str | None:
     """Remove URLs + basic noise. Return cleaned text or None if noise."""
     # Remove URLs
@@ -41,43 +58,58 @@ def clean_text(msg: str) -> str | None:
 
     return msg
 
-def parse_and_merge_messages(raw_lines, merge_seconds=40):
+def read_export(path, start_line=0):
+    """Lazily yield the lines of an export file, starting at start_line."""
+    with open(path, "r", encoding="utf-8") as f:
+        yield from itertools.islice(f, start_line, None)
+
+def iter_raw_messages(raw_lines):
     """
-    Parse WhatsApp raw export lines, clean each message,
-    merge consecutive messages from the same sender,
-    and return a final clean message list.
+    Lazily parse WhatsApp export lines into messages.
+    Lines without a timestamp are continuation lines of a multi-line message
+    and are joined onto it; timestamped lines that are not user messages
+    (system and media lines) are skipped together with their continuations.
     """
-
-    parsed_msgs = []
-
-    # 1) Parse raw lines
+    current = None
     for line in raw_lines:
+        line = line.rstrip("\r\n")
         m = WHATSAPP_PATTERN.match(line)
-        if not m:
-            continue  # skip lines that don't match WhatsApp format
-
-        date_str, time_str, name, text = m.groups()
-        dt = datetime.strptime(date_str + " " + time_str, "%d/%m/%Y %H:%M:%S")
-
-        cleaned = clean_text(text)
+        if m:
+            if current is not None:
+                yield current
+            date_str, time_str, name, text = m.groups()
+            current = {
+                "time": parse_time(date_str, time_str),
+                "name": name,
+                "text": text
+            }
+        elif LINE_TIME_PATTERN.match(line):
+            if current is not None:
+                yield current
+            current = None  # skip lines that don't match WhatsApp format
+        elif current is not None:
+            current["text"] += "\n" + line
+
+    if current is not None:
+        yield current
+
+def iter_clean_messages(messages):
+    """Clean each message, dropping noise."""
+    for msg in messages:
+        cleaned = clean_text(msg["text"])
         if cleaned is None:
             continue  # skip noise
-
-        parsed_msgs.append({
-            "time": dt,
-            "name": name,
-            "text": cleaned
-        })
-
-    # 2) Merge consecutive messages from the same sender
-    merged = []
-    for msg in parsed_msgs:
-        if not merged:
-            merged.append(msg)
+        msg["text"] = cleaned
+        yield msg
+
+def merge_messages(messages, merge_seconds=40):
+    """Merge consecutive messages from the same sender, holding only the last one in memory."""
+    last = None
+    for msg in messages:
+        if last is None:
+            last = msg
             continue
 
-        last = merged[-1]
-
         same_sender = msg["name"] == last["name"]
         close_in_time = (msg["time"] - last["time"]).total_seconds() <= merge_seconds
 
@@ -86,6 +118,84 @@ def parse_and_merge_messages(raw_lines, merge_seconds=40):
             last["text"] += "\n" + msg["text"]
             last["time"] = msg["time"]
         else:
-            merged.append(msg)
+            yield last
+            last = msg
+
+    if last is not None:
+        yield last
+
+def iter_messages(raw_lines, merge_seconds=40):
+    """Streaming parse -> clean -> merge pipeline over an iterable of export lines."""
+    return merge_messages(iter_clean_messages(iter_raw_messages(raw_lines)), merge_seconds)
+
+def parse_and_merge_messages(raw_lines, merge_seconds=40):
+    """
+    Parse WhatsApp raw export lines, clean each message,
+    merge consecutive messages from the same sender,
+    and return a final clean message list.
+    """
+    return list(iter_messages(raw_lines, merge_seconds))
+
+
+def scan_export(raw_lines, last_time=None, ingested_lines=None):
+    """
+    Find the chat watermark in one streaming pass over an export.
+    The first ingested_lines lines were already ingested; everything after is
+    new. States saved before line counts were kept only have last_time: lines
+    stamped at or before it (and their continuation lines) count as ingested.
+    Returns a dict with:
+      prefix_hash    - hash of the already-ingested lines, to detect a rewritten history
+                       (None if the export is shorter than what was ingested)
+      full_hash      - hash of all lines, the content hash of the new watermark
+      last_time      - timestamp of the last line in the export
+      lines          - number of lines in the export, the line count of the new watermark
+      first_new_line - index of the first line that still needs processing
+    """
+    digest = hashlib.sha256()
+    prefix_hash = None
+    first_new_line = 0 if last_time is None and not ingested_lines else None
+    line_time = None
+    n_lines = 0
+
+    for n_lines, line in enumerate(raw_lines, start=1):
+        m = LINE_TIME_PATTERN.match(line)
+        if m:
+            line_time = parse_time(*m.groups())
+
+        if first_new_line is None:
+            if ingested_lines is not None:
+                # A message stamped in the watermark's second is still new
+                is_new = n_lines > ingested_lines
+            else:
+                is_new = line_time is not None and line_time > last_time
+            if is_new:
+                prefix_hash = digest.hexdigest()
+                first_new_line = n_lines - 1
+
+        digest.update(line.rstrip("\r\n").encode("utf-8") + b"\n")
+
+    full_hash = digest.hexdigest()
+    if first_new_line is None and (ingested_lines is None or n_lines == ingested_lines):
+        prefix_hash = full_hash  # nothing new
+    return {
+        "prefix_hash": prefix_hash,
+        "full_hash": full_hash,
+        "last_time": line_time or last_time,
+        "lines": n_lines,
+        "first_new_line": n_lines if first_new_line is None else first_new_line,
+    }
+
+def parse_export(path, last_time=None, expected_hash=None, ingested_lines=None):
+    """
+    Scan one export and parse everything after its watermark. A top-level
+    function so it can run in a worker process.
+    If the already-ingested part no longer hashes to expected_hash the whole
+    export is parsed and `reset` is True. Returns (scan, messages, reset).
+    """
+    scan = scan_export(read_export(path), last_time, ingested_lines)
+    reset = expected_hash is not None and scan["prefix_hash"] != expected_hash
+    if reset:
+        scan = scan_export(read_export(path))
 
-    return merged
\ No newline at end of file
+    messages = parse_and_merge_messages(read_export(path, scan["first_new_line"]))
+    return scan, messages, reset
\ No newline at end of file
@@ -1,68 +1,154 @@
 import os
 import json
+import shutil
+import hashlib
+import pandas as pd
 from Config import *
 from Agent.Agent import *
 from Agent.Prompts import *
-from datetime import timedelta
+from Agent.Executor import LLMExecutor
+from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from openai import BadRequestError
 from Preprocess.Create_Data import *
+from Preprocess.Checkpoint import Checkpoint, run_key
+from RAG.VectorStore import VectorStore
+from Metrics import metrics
 
 def chunk_list(data, chunk_size):
     """Yield successive n-sized chunks from data."""
     for i in range(0, len(data), chunk_size):
         yield data[i:i + chunk_size]
 
-def process_all_messages(all_raw_messages, chunk_size=100):
+def pack_batches(items, item_tokens, token_budget, max_items):
+    """
+    Yield consecutive batches of items whose summed token estimate stays under
+    token_budget (and at most max_items long). An item larger than the budget
+    gets a batch of its own.
+    """
+    batch, batch_tokens = [], 0
+    for item in items:
+        tokens = item_tokens(item)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= max_items):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+# Failures caused by the batch itself (malformed answer, context overflow); anything
+# else (network, auth, quota) was already retried by the executor and is re-raised
+BISECT_ERRORS = (ValueError, KeyError, BadRequestError)
+
+def call_with_bisection(items, run_batch, on_failure):
+    """
+    Run run_batch(items). If it raises one of BISECT_ERRORS, split the batch in
+    half and retry each half recursively, so only the items that truly fail
+    reach on_failure(item, error). Returns the concatenated results.
+    """
+    try:
+        return run_batch(items)
+    except BISECT_ERRORS as e:
+        if len(items) == 1:
+            return on_failure(items[0], e)
+        mid = len(items) // 2
+        print(f"Batch of {len(items)} failed ({e}). Retrying as {mid} + {len(items) - mid}")
+        return call_with_bisection(items[:mid], run_batch, on_failure) + \
+            call_with_bisection(items[mid:], run_batch, on_failure)
+
+def parse_llm_json(response):
+    clean_text = response.replace("```json", "").replace("```", "").strip()
+    try:
+        result = json.loads(clean_text)
+        if not isinstance(result, dict):
+            raise ValueError(f"expected a JSON object, got {type(result).__name__}")
+        return result
+    except ValueError as e:
+        e.response = clean_text # keep the raw answer for manual fixing
+        raise
+
+def message_line(idx, msg):
+    # We include the name because context matters (e.g., Maya asking vs Maya answering)
+    return f"{idx}: {msg['name']}: {msg['text']}\n"
+
+def classify_chunk(chunk, executor):
+    """Classify one batch of messages in place, tagging every message with a topic. Raises on failure."""
+     # 1. Prepare the text block with IDs
+    message_block = "".join(message_line(idx, msg) for idx, msg in enumerate(chunk))
+
+    # 2. Call the LLM with the SYSTEM_PROMPT and the message block
+    response = executor.call(wedding_topics_classifier, message_block)
+
+    # 3. Robust Parsing and Mapping (as defined in our previous fixes)
+    with uncache_on_error(wedding_topics_classifier, message_block):
+        results = parse_llm_json(response)
+
+    # Map categories back safely
+    clean_results = {str(k).replace('"', ''): v for k, v in results.items()}
+
+    for j, msg in enumerate(chunk):
+        # Use str(j) because the keys in the JSON are string IDs (0, 1, 2...)
+        topic = clean_results.get(str(j))
+        msg['topic'] = topic if isinstance(topic, str) else "unknown"
+
+    return chunk
+
+def classify_with_bisection(i, chunk, executor):
+    print(f"Processing chunk {i + 1} ({len(chunk)} messages)...")
+
+    def on_failure(msg, e):
+        print(f"Error classifying message in chunk {i + 1}. Failed to parse JSON or call model: {e}")
+        # Fallback: only the message that keeps failing is tagged as 'unknown'
+        metrics.inc("ingest_failed_items_total", stage="classify")
+        msg['topic'] = "unknown"
+        return [msg]
+
+    return call_with_bisection(chunk, lambda batch: classify_chunk(batch, executor), on_failure)
+
+def process_all_messages(all_raw_messages, token_budget=None, max_batch_size=None, executor=None):
     """
     Main pipeline function to process all messages in chunks.
-    Assumes you have a function called 'classify_messages_with_llm'
-    that takes a list of messages and returns the categorized list.
+    Messages are packed into batches by token budget, classified concurrently
+    through the LLMExecutor and returned in their original order.
     """
-    classified_results = []
-    
-    # Iterate through chunks
-    for i, chunk in enumerate(chunk_list(all_raw_messages, chunk_size)):
-        print(f"Processing chunk {i + 1}...")
-        
-         # 1. Prepare the text block with IDs
-        message_block = ""
-        for idx, msg in enumerate(chunk):
-            # We include the name because context matters (e.g., Maya asking vs Maya answering)
-            message_block += f"{idx}: {msg['name']}: {msg['text']}\n"
-        
-        try:
-            # 2. Call the LLM with the SYSTEM_PROMPT and the message block
-            response = ask_agent(wedding_topics_classifier, message_block)
+    config = Config()
+    executor = executor or LLMExecutor()
+    token_budget = token_budget or config.classify_batch_tokens
+    max_batch_size = max_batch_size or config.classify_max_batch
 
-            # 3. Robust Parsing and Mapping (as defined in our previous fixes)
-            clean_text = response.replace("```json", "").replace("```", "").strip()
-            results = json.loads(clean_text)
-            
-            # Map categories back safely
-            clean_results = {str(k).replace('"', ''): v for k, v in results.items()}
-            
-            for j, msg in enumerate(chunk):
-                # Use str(j) because the keys in the JSON are string IDs (0, 1, 2...)
-                msg['topic'] = clean_results.get(str(j), "unknown") 
-                
-            classified_results.extend(chunk)
-
-        except Exception as e:
-            print(f"Error processing chunk {i + 1}. Failed to parse JSON or call model: {e}")
-            # Fallback: If classification fails, tag all messages in the chunk as 'unknown'
-            for msg in chunk:
-                msg['topic'] = "unknown"
-            classified_results.extend(chunk)
-            
+    chunks = list(enumerate(pack_batches(
+        all_raw_messages,
+        lambda msg: estimate_tokens(message_line(max_batch_size, msg)),
+        token_budget,
+        max_batch_size,
+    )))
+
+    classified_chunks = executor.map(lambda item: classify_with_bisection(item[0], item[1], executor), chunks)
+
+    classified_results = []
+    for chunk in classified_chunks:
+        classified_results.extend(chunk)
     return classified_results
 
-def aggregate_topic_chunks(messages, time_window_minutes=60):
+def aggregate_topic_chunks(messages, time_window_minutes=60, open_chunks=None):
     """
     Groups messages by topic and then concatenates consecutive messages
     within a specific time window into cohesive RAG chunks.
+    open_chunks are documents from a previous run (with their 'doc_id') that
+    new messages may still extend; only the extended ones are returned again.
     """
     topic_chunks = defaultdict(list)
-    
+    for doc in open_chunks or []:
+        topic_chunks[doc['topic']].append({
+            'topic': doc['topic'],
+            'messages': doc['raw_text'].split("[MES]"),
+            'start_time': doc['timing'],
+            'doc_id': doc['doc_id'],
+            'extended': False
+        })
+
     # Sort messages by time to ensure proper sequence
     messages.sort(key=lambda x: x['time'])
 
@@ -89,6 +175,7 @@ def aggregate_topic_chunks(messages, time_window_minutes=60):
             # and that it is the same topic (implied by the defaultdict key)
             if time_diff < timedelta(minutes=time_window_minutes):
                 last_chunk['messages'].append(message_str)
+                last_chunk['extended'] = True
             else:
                 # Start a new chunk for the same topic (but different time chapter)
                 topic_chunks[topic].append({
@@ -101,74 +188,279 @@ def aggregate_topic_chunks(messages, time_window_minutes=60):
     rag_documents = []
     for topic, chunks in topic_chunks.items():
         for chunk in chunks:
+            if chunk.get('extended') is False:
+                continue # open chunk from a previous run with nothing new
             raw_text = "[MES]".join(chunk['messages'])
             rag_documents.append({
                 'topic': topic,
                 'raw_text': raw_text,
-                'timing': chunk['start_time']
+                'timing': chunk['start_time'],
+                'doc_id': chunk.get('doc_id')
             })
 
     return rag_documents
 
 
-def synthesize_data(aggregated_chunks, batch_size=30):
+SUMMARY_FIELDS = {"summary", "all_names", "locations"}
+
+def chunk_line(i, chunk):
+    return f"id: {i}, Topic: {chunk['topic']}, Messages: {chunk['raw_text']}\n"
+
+def synthesize_batch(aggregated_chunks, indices, executor):
+    """
+    Summarize the chunks at `indices` in one LLM call. Returns (dataset rows, indices
+    the answer left out); ids outside `indices` are ignored. Raises on failure.
+    """
+    complit_chunk = "".join(chunk_line(i, aggregated_chunks[i]) for i in indices)
+
+    response = executor.call(summary_prompt, complit_chunk)
+    # 3. Robust Parsing
+    with uncache_on_error(summary_prompt, complit_chunk):
+        synthesized_data = parse_llm_json(response)
+
+        # 4. Final Data Structure for Vector DB
+        rows, answered = [], set()
+        for i, row in synthesized_data.items():
+            i = int(str(i).replace('"', ''))
+            if i not in indices or i in answered:
+                print(f"Ignoring summary of chunk {i}, which was not in the batch")
+                continue
+            if not isinstance(row, dict) or not SUMMARY_FIELDS <= row.keys():
+                raise ValueError(f"malformed summary of chunk {i}: {row!r}")
+            answered.add(i)
+            curr_chunk = aggregated_chunks[i]
+            rows.append({
+                "source_topic": curr_chunk['topic'],
+                "summary_text": row['summary'], # This is your vector content
+                "all_names": row['all_names'], # Filterable fields
+                "locations": row['locations'],
+                "original_msg": curr_chunk['raw_text'],
+                "timing": curr_chunk['timing'],
+                "doc_id": curr_chunk.get('doc_id')
+            })
+    return rows, [i for i in indices if i not in answered]
+
+def synthesize_with_bisection(batch_number, indices, aggregated_chunks, executor):
+    """Returns (rows, errors) for one packed batch."""
+    print(f"\n--- Processing Batch {batch_number + 1} (Chunks {indices[0]} to {indices[-1]}) ---")
+    errors = []
+
+    def on_failure(i, e):
+        print(f"Error during synthesis of chunk {i}: {e}")
+        # Skip or log error, ensuring the process continues
+        metrics.inc("ingest_failed_items_total", stage="synthesize")
+        errors.append(getattr(e, 'response', chunk_line(i, aggregated_chunks[i])))
+        return []
+
+    def run_batch(batch):
+        rows, missing = synthesize_batch(aggregated_chunks, batch, executor)
+        if len(missing) == len(batch):
+            raise ValueError(f"no summary for chunks {batch[0]} to {batch[-1]}")
+        if missing:
+            # Chunks the model left out are asked again on their own
+            rows += call_with_bisection(missing, run_batch, on_failure)
+        return rows
+
+    rows = call_with_bisection(indices, run_batch, on_failure)
+    return rows, errors
+
+def synthesize_data(aggregated_chunks, token_budget=None, max_batch_size=None, executor=None):
     """
     Runs the LLM synthesis on each aggregated chunk to create the final dataset.
+    Chunks are packed into batches by token budget; batches run concurrently
+    and rows come back in batch order.
     """
+    config = Config()
+    executor = executor or LLMExecutor()
+    token_budget = token_budget or config.synthesis_batch_tokens
+    max_batch_size = max_batch_size or config.synthesis_max_batch
+
+    batches = list(enumerate(pack_batches(
+        range(len(aggregated_chunks)),
+        lambda i: estimate_tokens(chunk_line(i, aggregated_chunks[i])),
+        token_budget,
+        max_batch_size,
+    )))
+
+    results = executor.map(
+        lambda b: synthesize_with_bisection(b[0], b[1], aggregated_chunks, executor), batches
+    )
+
     final_rag_dataset = []
     errors = []
-    num_chunks = len(aggregated_chunks)
-    
-    for start_index in range(0, num_chunks, batch_size):
-        end_index = min(start_index + batch_size, num_chunks)
-        print(f"\n--- Processing Batch {start_index // batch_size + 1} (Chunks {start_index} to {end_index-1}) ---")       
-        complit_chunk = "" 
-        for i in range(start_index, end_index):
-            chunk = aggregated_chunks[i]
-            complit_chunk += f"id: {i}, Topic: {chunk['topic']}, Messages: {chunk['raw_text']}\n"
-        try:
-            response = ask_agent(summary_prompt, complit_chunk)
-            # 3. Robust Parsing
-            clean_text = response.replace("```json", "").replace("```", "").strip()
-            synthesized_data = json.loads(clean_text)
-            
-            # 4. Final Data Structure for Vector DB
-            for i, row in synthesized_data.items():
-                curr_chunk = aggregated_chunks[int(i)]
-                final_rag_dataset.append({
-                    "source_topic": curr_chunk['topic'],
-                    "summary_text": row['summary'], # This is your vector content
-                    "all_names": row['all_names'], # Filterable fields
-                    "locations": row['locations'],
-                    "original_msg": curr_chunk['raw_text'], 
-                    "timing": curr_chunk['timing']
-                })
-
-        except Exception as e:
-            print(f"Error during synthesis of chunk {i + 1}: {e}")
-            errors.append(clean_text)
-            # Skip or log error, ensuring the process continues
+    for rows, batch_errors in results:
+        final_rag_dataset.extend(rows)
+        errors.extend(batch_errors)
 
     return final_rag_dataset, errors
 
-def full_process():
+def make_doc_id(chat, chunk):
+    """Stable id of a thread document, so a later run can replace it in place."""
+    key = f"{chat}|{chunk['topic']}|{chunk['timing'].isoformat()}"
+    return f"{chunk['topic']}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}"
+
+def load_ingest_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_ingest_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+def parse_chats(files, state, workers=None):
+    """
+    Scan and parse every export in a process pool, one file per worker.
+    Results keep the order of files. Returns a list of (scan, messages, reset).
+    """
     config = Config()
-    files = os.listdir(config.text_file_location)
+    workers = workers or config.parse_workers or os.cpu_count()
+    paths, last_times, hashes, line_counts = [], [], [], []
+    for file in files:
+        chat_state = state.get(file)
+        paths.append(os.path.join(config.text_file_location, file))
+        last_times.append(datetime.fromisoformat(chat_state['last_time']) if chat_state else None)
+        hashes.append(chat_state['hash'] if chat_state else None)
+        line_counts.append(chat_state.get('lines') if chat_state else None)
+
+    if workers == 1 or len(files) <= 1:
+        return list(map(parse_export, paths, last_times, hashes, line_counts))
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+        return list(pool.map(parse_export, paths, last_times, hashes, line_counts))
+
+def ingest_chat(file, chat_state, parsed, executor, time_window_minutes=120, checkpoint=None, trace=None):
+    """
+    Run classify -> aggregate -> synthesize on the parsed part of one chat
+    export that is newer than its watermark (the whole chat if chat_state is None).
+    Threads still open at the watermark are extended and re-synthesized under
+    their old doc_id. With a checkpoint, finished stages are loaded instead of rerun.
+    Stage timings go to `trace`.
+    Returns (dataset rows, stale doc ids, new chat state).
+    """
+    trace = trace or metrics.trace("ingest", sampled=False)
+
+    def run(stage, compute):
+        with trace.span(stage):
+            return checkpoint.run(stage, compute) if checkpoint else compute()
+
+    scan, messages, reset = parsed
+    old_ids = set(chat_state['doc_ids']) if chat_state else set()
+
+    if reset:
+        # The already-ingested part of the export differs (edited/other export) - start over
+        print(f"{file}: history changed since the last ingest, reprocessing the whole chat")
+        chat_state = None
+
+    doc_ids = set(chat_state['doc_ids']) if chat_state else set()
+    tail = [dict(doc, timing=datetime.fromisoformat(doc['timing'])) for doc in chat_state['tail']] if chat_state else []
+
+    rows, chunks = [], []
+    if messages:
+        print(f"{file}: {len(messages)} new messages")
+        classified_results = run("classify", lambda: process_all_messages(messages, executor=executor))
+
+        def aggregate():
+            chunks = aggregate_topic_chunks(classified_results, time_window_minutes=time_window_minutes, open_chunks=tail)
+            for chunk in chunks:
+                chunk['doc_id'] = chunk['doc_id'] or make_doc_id(file, chunk)
+            return chunks
+
+        chunks = run("aggregate", aggregate)
+        rows, errors = run("synthesize", lambda: synthesize_data(chunks, executor=executor))
+        doc_ids.update(row['doc_id'] for row in rows)
+        metrics.inc("ingest_messages_total", len(messages))
+        metrics.inc("ingest_documents_total", len(rows))
+        trace.set(messages=len(messages), chunks=len(chunks), documents=len(rows), errors=len(errors))
+
+    # Keep the latest thread per topic that can still be extended by the next export
+    latest = {doc['topic']: doc for doc in tail}
+    for chunk in chunks:
+        if chunk['topic'] not in latest or chunk['timing'] >= latest[chunk['topic']]['timing']:
+            latest[chunk['topic']] = chunk
+
+    if scan['last_time'] is None:
+        return rows, old_ids - doc_ids, chat_state
+
+    window_start = scan['last_time'] - timedelta(minutes=time_window_minutes)
+    new_state = {
+        'last_time': scan['last_time'].isoformat(),
+        'hash': scan['full_hash'],
+        'lines': scan['lines'],
+        'doc_ids': sorted(doc_ids),
+        'tail': [
+            {'topic': doc['topic'], 'raw_text': doc['raw_text'], 'timing': doc['timing'].isoformat(), 'doc_id': doc['doc_id']}
+            for doc in latest.values() if doc['timing'] >= window_start
+        ]
+    }
+    return rows, old_ids - doc_ids, new_state
+
+def full_process(incremental=True):
+    """
+    Build the RAG dataset from the WhatsApp exports.
+    With incremental=True only messages newer than each chat's watermark go
+    through the pipeline, and their documents are upserted (by doc_id) into
+    the dataset and, if it exists, the saved vector index.
+    Every stage of every file is checkpointed under config.checkpoint_path and
+    LLM responses are cached, so rerunning after a crash resumes where it stopped.
+    """
+    config = Config()
+    files = sorted(os.listdir(config.text_file_location))
+    state = load_ingest_state(config.ingest_state_path) if incremental else {}
+    executor = LLMExecutor()
+    # Ingest runs are rare and long: always log their traces
+    trace = metrics.trace("full_process", sampled=True)
+
+    checkpoints = {
+        file: Checkpoint(config.checkpoint_path, file, run_key(os.path.join(config.text_file_location, file), state.get(file)))
+        for file in files
+    }
+    parsed_chats = [checkpoints[file].load("parse") for file in files]
+    to_parse = [file for file, parsed in zip(files, parsed_chats) if parsed is None]
+    with trace.span("parse"):
+        newly_parsed = parse_chats(to_parse, state)
+    for file, parsed in zip(to_parse, newly_parsed):
+        checkpoints[file].save("parse", parsed)
+        parsed_chats[files.index(file)] = parsed
 
     rag_dataset = []
-    
-    for file in files:
-        message = []
-        with open(os.path.join(config.text_file_location, file),"r", encoding="utf-8") as f:
-            raw = f.readlines()
-        messages.extend(parse_and_merge_messages(raw))
+    stale_ids = set()
+    for file, parsed in zip(files, parsed_chats):
+        chat_trace = metrics.trace("ingest", sampled=True)
+        rows, stale, state[file] = ingest_chat(file, state.get(file), parsed, executor, checkpoint=checkpoints[file], trace=chat_trace)
+        chat_trace.finish(file=file, stale_documents=len(stale))
+        rag_dataset.extend(rows)
+        stale_ids.update(stale)
 
-        classified_results = process_all_messages(messages)
-        chunks = aggregate_topic_chunks(classified_results, time_window_minutes=120)
-        rag_dataset_i, errors = synthesize_data(chunks)
-        rag_dataset.extend(rag_dataset_i)
+    new_df = pd.DataFrame(rag_dataset)
+    if incremental and os.path.exists(config.dataset):
+        old_df = pd.read_csv(config.dataset, dtype={"doc_id": str})
+        old_df = old_df.loc[:, ~old_df.columns.str.startswith("Unnamed")]
+        if "doc_id" in old_df:
+            replaced_ids = stale_ids | (set(new_df["doc_id"]) if "doc_id" in new_df else set())
+            old_df = old_df[~old_df["doc_id"].isin(replaced_ids)]
+        df = pd.concat([old_df, new_df], ignore_index=True)
+    else:
+        df = new_df
+    with trace.span("write_dataset"):
+        df.to_csv(config.dataset, index=False)
+
+    # A missing index is built by Main on launch
+    if os.path.exists(config.vector_store_path):
+        v_store = VectorStore()
+        with trace.span("update_index"):
+            if incremental:
+                v_store.update_vector(new_df, stale_ids)
+            else:
+                v_store.create_vector()
 
-    pd.DataFrame(rag_dataset).to_csv(config.saved_path)
+    save_ingest_state(config.ingest_state_path, state)
+    # The run is complete, the next one starts from the new watermarks
+    shutil.rmtree(config.checkpoint_path, ignore_errors=True)
+    trace.finish(files=len(files), documents=len(rag_dataset), stale_documents=len(stale_ids))
 
 if __name__ == "__main__":
     full_process()
\ No newline at end of file
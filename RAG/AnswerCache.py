@@ -0,0 +1,129 @@
+import re
+import time
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from Metrics import metrics
+
+
+class AnswerCache:
+    """
+    Cache of generated answers in front of RAG.rag_answer.
+    A lookup first tries an exact match on the normalized query, then the most
+    similar cached query embedding (cosine >= similarity_threshold).
+    Entries expire after ttl_seconds and the least recently used ones are
+    evicted past max_entries. With `path` set, entries are also kept in a
+    SQLite file and survive restarts; they are dropped when the cache is opened
+    against another index version (the index is loaded once, at startup).
+    """
+
+    def __init__(self, max_entries, ttl_seconds, similarity_threshold, index_version, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.index_version = index_version
+        self.entries = OrderedDict()  # normalized query -> (answer, unit embedding, created)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._matrix = None
+        self._matrix_keys = []
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS answers (query TEXT PRIMARY KEY, answer TEXT, embedding BLOB, created REAL, last_used REAL)"
+            )
+            self._load()
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+    def _load(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'index_version'").fetchone()
+        if row is None or row[0] != self.index_version:
+            # Answers were generated from another version of the index
+            self.db.execute("DELETE FROM answers")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('index_version', ?)", (self.index_version,))
+            self.db.commit()
+            return
+
+        rows = self.db.execute(
+            "SELECT query, answer, embedding, created FROM answers ORDER BY last_used DESC LIMIT ?", (self.max_entries,)
+        ).fetchall()
+        for query, answer, embedding, created in reversed(rows):
+            self.entries[query] = (answer, np.frombuffer(embedding, dtype=np.float32), created)
+
+    def _expired(self, created):
+        return time.time() - created > self.ttl_seconds
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        self._matrix = None
+        if self.db is not None:
+            self.db.execute("DELETE FROM answers WHERE query = ?", (key,))
+
+    def _nearest(self, embedding):
+        if self._matrix is None:
+            self._matrix_keys = list(self.entries)
+            self._matrix = np.array([self.entries[k][1] for k in self._matrix_keys], dtype=np.float32).reshape(-1, len(embedding))
+        if not self._matrix_keys:
+            return None, 0.0
+        similarities = self._matrix @ embedding
+        best = int(np.argmax(similarities))
+        return self._matrix_keys[best], float(similarities[best])
+
+    def get(self, query, embedding):
+        """Cached answer for the query (or a near-identical one), or None."""
+        key = self.normalize(query)
+        embedding = unit(embedding)
+        with self.lock:
+            if key not in self.entries:
+                nearest, similarity = self._nearest(embedding)
+                if nearest is not None and similarity >= self.similarity_threshold:
+                    key = nearest
+
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[2]):
+                self._remove(key)
+                if self.db is not None:
+                    self.db.commit()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                metrics.inc("cache_requests_total", cache="answer", result="miss")
+                return None
+
+            self.hits += 1
+            metrics.inc("cache_requests_total", cache="answer", result="hit")
+            self.entries.move_to_end(key)
+            if self.db is not None:
+                self.db.execute("UPDATE answers SET last_used = ? WHERE query = ?", (time.time(), key))
+                self.db.commit()
+            return entry[0]
+
+    def put(self, query, embedding, answer):
+        key = self.normalize(query)
+        embedding = unit(embedding)
+        now = time.time()
+        with self.lock:
+            self.entries[key] = (answer, embedding, now)
+            self.entries.move_to_end(key)
+            self._matrix = None
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)", (key, answer, embedding.tobytes(), now, now)
+                )
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+            if self.db is not None:
+                self.db.commit()
+
+def unit(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm else embedding
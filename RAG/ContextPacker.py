@@ -0,0 +1,89 @@
+from Agent.Agent import config, estimate_tokens
+
+CONVERSATION_SEPARATOR = "\n\nConversation:\n"
+MESSAGE_SEPARATOR = "[MES]"
+
+
+class ContextPacker:
+    """
+    Fits retrieved documents into the generation prompt under a token budget.
+    Documents are ranked by retrieval score (topic section first). Summaries are
+    packed first; excerpts of the original thread are added in a second pass
+    only while budget remains. Threads that mostly repeat an already packed
+    thread are dropped.
+    """
+
+    def __init__(self, token_budget, excerpt_tokens, duplicate_threshold, min_excerpt_tokens=40):
+        self.token_budget = token_budget
+        self.excerpt_tokens = excerpt_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_excerpt_tokens = min_excerpt_tokens
+
+    @staticmethod
+    def split(doc):
+        summary, _, thread = doc.page_content.partition(CONVERSATION_SEPARATOR)
+        return summary.strip(), thread
+
+    def is_duplicate(self, words, seen):
+        for other in seen:
+            union = len(words | other)
+            if union and len(words & other) / union >= self.duplicate_threshold:
+                return True
+        return False
+
+    def excerpt(self, thread, max_tokens):
+        """Leading messages of the thread that fit in max_tokens."""
+        parts, used = [], 0
+        for message in thread.split(MESSAGE_SEPARATOR):
+            tokens = estimate_tokens(message)
+            if used + tokens > max_tokens:
+                if not parts:
+                    # First message alone is too long: cut it
+                    parts.append(message[:max(0, max_tokens - 1) * config.chars_per_token] + "…")
+                else:
+                    parts.append("…")
+                break
+            parts.append(message)
+            used += tokens
+        return "\n".join(parts)
+
+    def pack(self, docs_topic, docs_general):
+        """
+        docs_topic / docs_general are (doc, score) pairs.
+        Returns the passages for each section, most relevant first.
+        """
+        ranked = [("topic", d, s) for d, s in sorted(docs_topic, key=lambda x: -x[1])] + \
+            [("general", d, s) for d, s in sorted(docs_general, key=lambda x: -x[1])]
+
+        # 1. Summaries, best first, skipping near-duplicate threads
+        budget = self.token_budget
+        packed, seen = [], []
+        for section, doc, _ in ranked:
+            summary, thread = self.split(doc)
+            words = set(thread.split())
+            if self.is_duplicate(words, seen):
+                continue
+            tokens = estimate_tokens(summary)
+            if tokens > budget:
+                continue
+            budget -= tokens
+            seen.append(words)
+            packed.append({"section": section, "summary": summary, "thread": thread, "excerpt": ""})
+
+        # 2. Thread excerpts while there is room
+        for item in packed:
+            if budget < self.min_excerpt_tokens:
+                break
+            if not item["thread"]:
+                continue
+            excerpt = self.excerpt(item["thread"], min(self.excerpt_tokens, budget))
+            budget -= estimate_tokens(excerpt)
+            item["excerpt"] = excerpt
+
+        passages = {"topic": [], "general": []}
+        for item in packed:
+            text = item["summary"]
+            if item["excerpt"]:
+                text += CONVERSATION_SEPARATOR + item["excerpt"]
+            passages[item["section"]].append(text)
+        return passages["topic"], passages["general"]
@@ -0,0 +1,80 @@
+import json
+import sqlite3
+import threading
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+# SQLite's default limit on host parameters in one statement is 999
+MAX_QUERY_IDS = 900
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    LangChain docstore kept in a SQLite file next to the FAISS index, instead of
+    the InMemoryDocstore that FAISS.save_local pickles.
+    Opening it reads nothing: documents are read on lookup, only for the ids
+    asked for, and the file is memory-mapped so serving processes share its
+    pages through the OS page cache. Topic is its own column, so filtering by
+    topic doesn't read the document text.
+    """
+
+    def __init__(self, path, mmap_bytes=256 * 2**20):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(f"PRAGMA mmap_size = {int(mmap_bytes)}")
+        self.db.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, topic TEXT, metadata TEXT, page_content TEXT)")
+        self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def add(self, texts):
+        # Times of freshly synthesized rows are datetimes; str() matches their CSV form
+        rows = [
+            (doc_id, doc.metadata.get("topic"), json.dumps(doc.metadata, ensure_ascii=False, default=str), doc.page_content)
+            for doc_id, doc in texts.items()
+        ]
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def delete(self, ids):
+        with self.lock:
+            self.db.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self.db.commit()
+
+    def _select(self, columns, ids):
+        rows = {}
+        with self.lock:
+            for start in range(0, len(ids), MAX_QUERY_IDS):
+                chunk = ids[start:start + MAX_QUERY_IDS]
+                placeholders = ", ".join("?" * len(chunk))
+                for row in self.db.execute(f"SELECT id, {columns} FROM docs WHERE id IN ({placeholders})", chunk):
+                    rows[row[0]] = row[1:]
+        return rows
+
+    def mget(self, ids):
+        """Documents for the ids in one query, in order (None for unknown ids)."""
+        ids = list(ids)
+        rows = self._select("metadata, page_content", ids)
+        docs = []
+        for doc_id in ids:
+            row = rows.get(doc_id)
+            docs.append(None if row is None else Document(id=doc_id, page_content=row[1], metadata=json.loads(row[0])))
+        return docs
+
+    def topics(self, ids):
+        """Topic of each id, in order, without reading the documents."""
+        ids = list(ids)
+        rows = self._select("topic", ids)
+        return [rows[doc_id][0] if doc_id in rows else None for doc_id in ids]
+
+    def search(self, search):
+        doc = self.mget([search])[0]
+        return doc if doc is not None else f"ID {search} not found."
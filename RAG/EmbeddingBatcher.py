@@ -0,0 +1,66 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from Metrics import metrics
+
+FILL_BUCKETS = [0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches query embeddings across concurrent chat turns.
+    Callers submit one query each; a worker thread takes the first waiting
+    query, collects more for up to max_wait_ms (or until max_batch_size),
+    encodes them in one encode(list_of_texts) call and hands each vector back
+    through its future.
+    """
+
+    def __init__(self, encode, max_batch_size, max_wait_ms):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, text):
+        """Queue one query; returns a concurrent.futures.Future of its embedding."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        future = Future()
+        self.queue.put((text, future))
+        metrics.set_gauge("embedding_queue_depth", self.queue.qsize())
+        return future
+
+    def embed(self, text):
+        return self.submit(text).result()
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            try:
+                # Take whatever is already queued, then wait out the rest of the window
+                batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            metrics.set_gauge("embedding_queue_depth", self.queue.qsize())
+            metrics.inc("embedding_batches_total")
+            metrics.inc("embedding_batched_queries_total", len(batch))
+            metrics.observe("embedding_batch_fill", len(batch) / self.max_batch_size, buckets=FILL_BUCKETS)
+            try:
+                vectors = self.encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
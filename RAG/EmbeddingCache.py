@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import numpy as np
+from Metrics import metrics
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of document embeddings.
+    Vectors are appended to a float32 matrix file that is memory-mapped for
+    reads; index.json maps sha256(model name + text) to a row of it.
+    The cache holds a single model: opening it with another model (or
+    dimension) evicts everything.
+    """
+
+    def __init__(self, path, model_name, dim):
+        self.path = path
+        self.model_name = model_name
+        self.dim = dim
+        self.matrix_path = os.path.join(path, "vectors.f32")
+        self.index_path = os.path.join(path, "index.json")
+        self.matrix = None
+
+        os.makedirs(path, exist_ok=True)
+        self.rows = self._load_index()
+        self._check_matrix()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data["model"] != self.model_name or data["dim"] != self.dim:
+            print(f"Embedding model changed ({data['model']} -> {self.model_name}), evicting the cache")
+            self.evict()
+            return {}
+        return data["rows"]
+
+    def _check_matrix(self):
+        """
+        Make the matrix file hold exactly the rows of the index. Vectors are written
+        before the index is saved, so an interrupted append leaves extra rows at the
+        end; without dropping them every later row would be misnumbered.
+        """
+        size = os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0
+        expected = len(self.rows) * self.dim * 4
+        if size > expected:
+            print(f"Dropping {(size - expected) // (self.dim * 4)} embeddings of an interrupted write")
+            os.truncate(self.matrix_path, expected)
+        elif size < expected:
+            print("Embedding cache is incomplete, evicting it")
+            self.evict()
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": self.dim, "rows": self.rows}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _open(self):
+        """Read-only memory map over the stored vectors."""
+        if self.matrix is None and self.rows:
+            self.matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dim))
+        return self.matrix
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed(self, texts, encode):
+        """
+        Return a (len(texts), dim) float32 array for texts.
+        Only texts missing from the cache are passed to encode(list_of_texts).
+        """
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.rows:
+                missing.setdefault(key, text)
+
+        metrics.inc("cache_requests_total", len(texts) - len(missing), cache="embedding", result="hit")
+        metrics.inc("cache_requests_total", len(missing), cache="embedding", result="miss")
+        if missing:
+            print(f"Embedding {len(missing)} new texts ({len(texts) - len(missing)} cached)")
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32).reshape(-1, self.dim)
+            self._append(list(missing), vectors)
+
+        if not keys:
+            return np.empty((0, self.dim), dtype=np.float32)
+        rows = np.fromiter((self.rows[key] for key in keys), dtype=np.int64, count=len(keys))
+        return self._open()[rows]
+
+    def _append(self, keys, vectors):
+        self.matrix = None
+        with open(self.matrix_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        for key in keys:
+            self.rows[key] = len(self.rows)
+        self._save_index()
+
+    def prune(self, texts):
+        """Drop every cached vector that doesn't belong to texts and compact the matrix file."""
+        keep = {self.key(text) for text in texts} & self.rows.keys()
+        if len(keep) == len(self.rows):
+            return
+        keys = sorted(keep, key=self.rows.get)
+        vectors = np.array(self._open()[[self.rows[key] for key in keys]]) if keys else np.empty((0, self.dim), dtype=np.float32)
+
+        self.matrix = None
+        tmp_path = self.matrix_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(vectors.tobytes())
+        os.replace(tmp_path, self.matrix_path)
+        self.rows = {key: i for i, key in enumerate(keys)}
+        self._save_index()
+
+    def evict(self):
+        """Remove all cached vectors (e.g. after switching embedding model)."""
+        self.matrix = None
+        self.rows = {}
+        for path in (self.matrix_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
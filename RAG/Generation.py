@@ -1,5 +1,12 @@
+import time
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from Agent.Agent import *
 from Agent.Prompts import rag_generative_prompt
+from RAG.ContextPacker import ContextPacker
+from RAG.TopicRouter import TopicRouter
+from Metrics import metrics
 
 TOPIC_KEYWORDS = {
     "venue": ["אולם", "גן", "מקום"],
@@ -33,41 +40,204 @@ TOPIC_KEYWORDS = {
     "engagement": ["אירוסין", "הצעה"],
 }
 
+TOPIC_ROUTER = TopicRouter(TOPIC_KEYWORDS)
+
+BUSY_MESSAGE = "יש כרגע עומס רב, נסו שוב בעוד כמה שניות."
+
 class RAG:
-    def __init__(self, retrieval):
+    def __init__(self, retrieval, answer_cache=None):
         self.get_retriever = retrieval.get_retriever
+        self.search = retrieval.search
+        self.search_batch = retrieval.search_batch
+        self.embed_query = retrieval.embed_query
+        self.query_batcher = retrieval.query_batcher
+        self.answer_cache = answer_cache
+        self.context_packer = ContextPacker(
+            token_budget=config.context_token_budget,
+            excerpt_tokens=config.context_excerpt_tokens,
+            duplicate_threshold=config.context_duplicate_threshold,
+        )
 
-    def context_prepration(self, docs):
-        return "\n\n---\n\n".join(
-            d.page_content
-            for d in docs
-        ) if docs else "אין נתונים רלוונטיים שנשלפו."
+        # Async serving: CPU-bound retrieval runs on a sized pool, at most
+        # max_concurrent_chats are answered at once and max_queued_chats may wait
+        self.cpu_executor = ThreadPoolExecutor(max_workers=config.serving_cpu_workers)
+        self.max_concurrent_chats = config.max_concurrent_chats
+        self.max_queued_chats = config.max_queued_chats
+        self.queued_chats = 0
+        self._semaphore = None
+
+    def context_prepration(self, passages):
+        return "\n\n---\n\n".join(passages) if passages else "אין נתונים רלוונטיים שנשלפו."
 
     def dedupe_docs(self, primary, secondary):
-        primary_ids = {d.id for d in primary}
-        return [d for d in secondary if d.id not in primary_ids]
+        primary_ids = {d.id for d, _ in primary}
+        return [(d, score) for d, score in secondary if d.id not in primary_ids]
+
+    def infer_topics(self, query):
+        """Best matching topics of the query (up to config.max_query_topics), best first."""
+        return TOPIC_ROUTER.route(query, top_n=config.max_query_topics)
 
     def infer_topic(self, query):
-        for topic, kws in TOPIC_KEYWORDS.items():
-            if any(k in query for k in kws):
-                return topic
-        return None
-    
+        topics = self.infer_topics(query)
+        return topics[0] if topics else None
+
+    async def aembed_query(self, query):
+        """Query embedding without holding a CPU worker while it waits for its micro-batch."""
+        if self.query_batcher is not None:
+            return np.array(await asyncio.wrap_future(self.query_batcher.submit(query)), dtype=np.float32)
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, self.embed_query, query)
+
+    def prepare(self, query, trace=None, query_embedding=None):
+        """
+        Everything before generation. Returns (cached_answer, None, embedding) on a
+        cache hit, otherwise (None, final_prompt_input, embedding).
+        Stage timings go to `trace` (an unsampled one if not given).
+        """
+        trace = trace or metrics.trace("chat", sampled=False)
+
+        # 0. Answer Cache (same or near-identical question)
+        if query_embedding is None:
+            with trace.span("embed_query"):
+                query_embedding = self.embed_query(query)
+        if self.answer_cache is not None:
+            with trace.span("answer_cache"):
+                cached = self.answer_cache.get(query, query_embedding)
+            if cached is not None:
+                return cached, None, query_embedding
 
-    def rag_answer(self, query: str, history: str = "") -> str:
         # 1. Topic Retrieval
-        topic_name = self.infer_topic(query) 
+        with trace.span("topic_inference"):
+            topic_names = self.infer_topics(query)
         
-        # 2. Document Retrieval
-        docs_topics = self.get_retriever(topic=topic_name).invoke(query)
-        docs_general = self.dedupe_docs(self.get_retriever().invoke(query), docs_topics)
+        # 2. Document Retrieval (one query embedding; the topic section spans every matched topic)
+        with trace.span("retrieval"):
+            docs_topics, docs_general = self.search(query, topics=topic_names, embedding=query_embedding)
+            docs_general = self.dedupe_docs(docs_topics, docs_general)
+        metrics.inc("retrieved_docs_total", len(docs_topics), section="topic")
+        metrics.inc("retrieved_docs_total", len(docs_general), section="general")
+        trace.set(topics=topic_names, docs_topic=len(docs_topics), docs_general=len(docs_general))
         
-        # 3. Prompt Formatting (using the RAG_GENERATIVE_PROMPT)
-        final_prompt_input = rag_generative_prompt.format(
+        # 3. Prompt Formatting (using the RAG_GENERATIVE_PROMPT), packed under the context token budget
+        with trace.span("prompt_formatting"):
+            final_prompt_input = self.format_prompt(query, docs_topics, docs_general)
+        return None, final_prompt_input, query_embedding
+
+    def format_prompt(self, query, docs_topics, docs_general):
+        passages_topic, passages_general = self.context_packer.pack(docs_topics, docs_general)
+        return rag_generative_prompt.format(
             user_query=query,
-            context_topic=self.context_prepration(docs_topics),
-            context_general=self.context_prepration(docs_general)
+            context_topic=self.context_prepration(passages_topic),
+            context_general=self.context_prepration(passages_general)
         )
-        
-        # 4. Generation
-        return ask_agent(prompt=final_prompt_input, data=query)
\ No newline at end of file
+
+    def prepare_batch(self, queries, embeddings):
+        """
+        Prompts for many queries at once (offline bulk answering): one batched
+        index search for all of them, no answer cache.
+        Returns a list of (final_prompt_input, topics, retrieved doc ids).
+        """
+        topics = [self.infer_topics(query) for query in queries]
+        results = self.search_batch(queries, embeddings, topics)
+        prepared = []
+        for query, query_topics, (docs_topics, docs_general) in zip(queries, topics, results):
+            docs_general = self.dedupe_docs(docs_topics, docs_general)
+            doc_ids = [doc.id for doc, _ in docs_topics + docs_general]
+            prepared.append((self.format_prompt(query, docs_topics, docs_general), query_topics, doc_ids))
+        return prepared
+
+    def rag_answer(self, query: str, history: str = ""):
+        """
+        Generator for gr.ChatInterface: retrieval finishes first, then the answer
+        is yielded (accumulated so far) as the model streams it.
+        """
+        trace = metrics.trace("chat")
+        start = time.perf_counter()
+        cached, final_prompt_input, query_embedding = self.prepare(query, trace)
+        if cached is not None:
+            self.finish_cached(trace)
+            yield cached
+            return
+        retrieval_seconds = time.perf_counter() - start
+
+        # 4. Generation (streamed)
+        answer = ""
+        first_token_seconds = None
+        usage = {}
+        with trace.span("generation"):
+            for token in stream_agent(prompt=final_prompt_input, data=query, usage=usage):
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - start
+                answer += token
+                yield answer
+
+        self.finish_turn(query, query_embedding, answer, start, retrieval_seconds, first_token_seconds, trace, usage)
+
+    def finish_cached(self, trace):
+        metrics.inc("chat_turns_total", result="cache_hit")
+        trace.finish(cache_hit=True)
+
+    def finish_turn(self, query, query_embedding, answer, start, retrieval_seconds, first_token_seconds, trace, usage):
+        total_seconds = time.perf_counter() - start
+        print(f"retrieval {retrieval_seconds:.2f}s, time to first token {first_token_seconds or total_seconds:.2f}s, total {total_seconds:.2f}s")
+        metrics.inc("chat_turns_total", result="answered")
+        metrics.observe("time_to_first_token_seconds", first_token_seconds or total_seconds)
+        trace.finish(cache_hit=False, ttft_ms=round((first_token_seconds or total_seconds) * 1000, 2), **usage)
+        if self.answer_cache is not None:
+            self.answer_cache.put(query, query_embedding, answer)
+
+    async def arag_answer(self, query: str, history: str = ""):
+        """
+        Async rag_answer for serving many chats from one process. Retrieval runs
+        on the CPU pool, generation is awaited, and when too many chats are
+        already waiting the request is turned away instead of queueing forever.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_chats)
+        if self._semaphore.locked() and self.queued_chats >= self.max_queued_chats:
+            metrics.inc("chat_turns_total", result="busy")
+            yield BUSY_MESSAGE
+            return
+
+        trace = metrics.trace("chat")
+        self.queued_chats += 1
+        try:
+            with trace.span("queue"):
+                await self._semaphore.acquire()
+        finally:
+            self.queued_chats -= 1
+
+        try:
+            start = time.perf_counter()
+            with trace.span("embed_query"):
+                query_embedding = await self.aembed_query(query)
+            loop = asyncio.get_running_loop()
+            cached, final_prompt_input, query_embedding = await loop.run_in_executor(
+                self.cpu_executor, self.prepare, query, trace, query_embedding
+            )
+            if cached is not None:
+                self.finish_cached(trace)
+                yield cached
+                return
+            retrieval_seconds = time.perf_counter() - start
+
+            # 4. Generation (streamed)
+            answer = ""
+            first_token_seconds = None
+            usage = {}
+            with trace.span("generation"):
+                async for token in astream_agent(prompt=final_prompt_input, data=query, usage=usage):
+                    if first_token_seconds is None:
+                        first_token_seconds = time.perf_counter() - start
+                    answer += token
+                    yield answer
+
+            self.finish_turn(query, query_embedding, answer, start, retrieval_seconds, first_token_seconds, trace, usage)
+        finally:
+            self._semaphore.release()
+
+    def answer(self, query: str, history: str = "") -> str:
+        """Blocking version of rag_answer that returns the full answer."""
+        answer = ""
+        for answer in self.rag_answer(query, history):
+            pass
+        return answer
\ No newline at end of file
@@ -0,0 +1,64 @@
+import faiss
+
+INDEX_TYPES = ["flat", "hnsw", "ivf_flat", "ivf_pq", "ivf_sq8"]
+
+
+def create_index(config, dim, n_vectors):
+    """
+    Build an empty (untrained) FAISS index of config.index_type.
+    nlist is capped so IVF training has ~39 points per centroid on small datasets,
+    and ivf_pq falls back to ivf_sq8 below the 2**pq_nbits points its codebooks need.
+    """
+    index_type = config.index_type
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, config.hnsw_m)
+        index.hnsw.efConstruction = config.hnsw_ef_construction
+        return index
+
+    if index_type == "ivf_pq" and n_vectors < 2 ** config.pq_nbits:
+        print(f"Only {n_vectors} vectors, too few to train {2 ** config.pq_nbits} PQ centroids, using ivf_sq8 instead of ivf_pq")
+        index_type = "ivf_sq8"
+
+    nlist = max(1, min(config.ivf_nlist, n_vectors // 39))
+    if nlist < config.ivf_nlist:
+        print(f"Only {n_vectors} vectors, using nlist={nlist} instead of {config.ivf_nlist}")
+    quantizer = faiss.IndexFlatL2(dim)
+
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, config.pq_m, config.pq_nbits)
+    elif index_type == "ivf_sq8":
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+    else:
+        raise ValueError(f"Unknown index_type {index_type!r}, expected one of {INDEX_TYPES}")
+
+    # Retrieval reconstructs candidate vectors for MMR; IVF needs a direct map for that
+    index.make_direct_map()
+    return index
+
+
+def train_index(index, vectors):
+    if not index.is_trained:
+        index.train(vectors)
+
+
+def tune_index(index, config):
+    """Apply the search-time parameters (efSearch / nprobe) to a built or loaded index."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.hnsw_ef_search
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = config.ivf_nprobe
+    return index
+
+
+def supports_removal(config):
+    """
+    Only the flat index renumbers its ids on remove_ids the way LangChain's
+    FAISS.delete expects; other types are rebuilt instead.
+    """
+    return config.index_type == "flat"
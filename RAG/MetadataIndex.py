@@ -0,0 +1,142 @@
+import os
+import re
+import ast
+import json
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from RAG.TopicRouter import KeywordMatcher
+
+ENTITY_FIELDS = ("names", "locations")
+FIELDS = ENTITY_FIELDS + ("topic",)
+
+
+def normalize_entity(value):
+    return " ".join(re.sub(r"[\"'`]", " ", str(value).lower()).split())
+
+def entity_values(value):
+    """Normalized entities of a names/locations field: a list, or its string form read back from the CSV."""
+    if isinstance(value, str):
+        try:
+            parsed = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed = value.split(",")
+        value = parsed if isinstance(parsed, (list, tuple)) else [value]
+    if not isinstance(value, (list, tuple)):
+        return []  # NaN / None
+    entities = [normalize_entity(item) for item in value]
+    return [entity for entity in dict.fromkeys(entities) if len(entity) >= 2]
+
+def time_key(value):
+    """Sortable 'YYYY-MM-DD HH:MM:SS' string of a document time (datetime or its string form)."""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, str) and value:
+        return value.replace("T", " ")
+    return None
+
+
+class MetadataIndex:
+    """
+    Inverted index over the document metadata, saved next to the FAISS index:
+    names / locations / topic value -> doc ids, and the document times kept
+    sorted, so exact lookups are dict hits and a time range is two bisections.
+    Known names and locations are found in a query with one Aho-Corasick pass.
+    """
+
+    def __init__(self):
+        self.postings = {field: {} for field in FIELDS}
+        self.doc_entries = {}  # doc id -> [(field, value)], to delete a document's postings
+        self.times = []  # sorted (time, doc id)
+        self.doc_times = {}
+        self._matcher = None
+
+    @classmethod
+    def from_docs(cls, docs):
+        metadata_index = cls()
+        metadata_index.add(docs)
+        return metadata_index
+
+    def __len__(self):
+        return len(self.doc_entries)
+
+    def add(self, docs):
+        for doc in docs:
+            if doc.id in self.doc_entries:
+                self.delete([doc.id])
+            entries = [(field, value) for field in ENTITY_FIELDS for value in entity_values(doc.metadata.get(field))]
+            if isinstance(doc.metadata.get("topic"), str):
+                entries.append(("topic", doc.metadata["topic"]))
+            for field, value in entries:
+                self.postings[field].setdefault(value, set()).add(doc.id)
+            self.doc_entries[doc.id] = entries
+
+            time = time_key(doc.metadata.get("time"))
+            if time is not None:
+                insort(self.times, (time, doc.id))
+                self.doc_times[doc.id] = time
+        self._matcher = None
+
+    def delete(self, doc_ids):
+        for doc_id in doc_ids:
+            for field, value in self.doc_entries.pop(doc_id, []):
+                ids = self.postings[field][value]
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[field][value]
+            time = self.doc_times.pop(doc_id, None)
+            if time is not None:
+                del self.times[bisect_left(self.times, (time, doc_id))]
+        self._matcher = None
+
+    def lookup(self, field, value):
+        """Ids of the documents whose `field` contains `value`."""
+        key = value if field == "topic" else normalize_entity(value)
+        return self.postings[field].get(key, set())
+
+    def topic_docs(self, topics):
+        return set().union(*(self.postings["topic"].get(topic, set()) for topic in topics))
+
+    def match_entities(self, query):
+        """Known names / locations mentioned in the query -> ids of the documents that mention them."""
+        if self._matcher is None:
+            self._matcher = KeywordMatcher({entity for field in ENTITY_FIELDS for entity in self.postings[field]}, whole_words=True)
+        found = {keyword for _, _, keyword in self._matcher.find(normalize_entity(query))}
+        return {
+            entity: self.postings["names"].get(entity, set()) | self.postings["locations"].get(entity, set())
+            for entity in found
+        }
+
+    def time_range(self, start=None, end=None):
+        """Ids of the documents with start <= time <= end (either bound may be None)."""
+        lo = 0 if start is None else bisect_left(self.times, (time_key(start),))
+        hi = len(self.times) if end is None else bisect_right(self.times, (time_key(end), "￿"))
+        return {doc_id for _, doc_id in self.times[lo:hi]}
+
+    def save(self, path):
+        data = {
+            "postings": {field: {value: sorted(ids) for value, ids in values.items()} for field, values in self.postings.items()},
+            "times": self.times,
+            "docs": list(self.doc_entries),
+        }
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved index, or return None if the vector index was saved without one."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        metadata_index = cls()
+        metadata_index.doc_entries = {doc_id: [] for doc_id in data["docs"]}
+        for field, values in data["postings"].items():
+            for value, ids in values.items():
+                metadata_index.postings[field][value] = set(ids)
+                for doc_id in ids:
+                    metadata_index.doc_entries[doc_id].append((field, value))
+        metadata_index.times = [tuple(entry) for entry in data["times"]]
+        metadata_index.doc_times = {doc_id: time for time, doc_id in metadata_index.times}
+        return metadata_index
@@ -1,17 +1,251 @@
 import re
+import math
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+# Time-filtered searches score every allowed document exactly up to this many
+EXACT_SEARCH_MAX = 2000
+MAX_ENTITY_CANDIDATES = 200
 
 class Retrieval:
-    def __init__(self, vectorstore, k=30):
+    def __init__(self, vectorstore, topic_index=None, metadata_index=None, query_batcher=None, k=30, lambda_mult=0.65, rrf_k=60):
         self.vector_store = vectorstore
+        self.topic_index = topic_index
+        self.metadata_index = metadata_index
+        self.query_batcher = query_batcher
         self.k = k
+        self.lambda_mult = lambda_mult
+        self.rrf_k = rrf_k
+        self._positions = None
 
     def get_retriever(self, topic=None):
-        search_kwargs = {"k": self.k / 2,  "fetch_k": self.k, "lambda_mult": 0.65}
-        
+        search_kwargs = {"k": self.k // 2,  "fetch_k": self.k, "lambda_mult": self.lambda_mult}
+
         if topic:
             search_kwargs["filter"] = {"topic": topic}
-        
+
         return self.vector_store.as_retriever(
             search_type="mmr",
             search_kwargs=search_kwargs
-        )
\ No newline at end of file
+        )
+
+    def embed_query(self, query):
+        if self.query_batcher is not None:
+            return np.array(self.query_batcher.embed(query), dtype=np.float32)
+        return np.array(self.vector_store.embedding_function(query), dtype=np.float32)
+
+    def get_docs(self, doc_ids):
+        docstore = self.vector_store.docstore
+        if hasattr(docstore, "mget"):
+            return docstore.mget(doc_ids)
+        return [docstore.search(doc_id) for doc_id in doc_ids]
+
+    def get_topics(self, doc_ids):
+        docstore = self.vector_store.docstore
+        if hasattr(docstore, "topics"):
+            return docstore.topics(doc_ids)
+        return [docstore.search(doc_id).metadata.get("topic") for doc_id in doc_ids]
+
+    def fetch_candidates(self, embedding, fetch_k):
+        """One index search; returns (doc_id, vector) pairs ordered by distance."""
+        _, indices = self.vector_store.index.search(embedding.reshape(1, -1), fetch_k)
+        indices = [int(i) for i in indices[0] if i != -1]  # -1 when the index has fewer docs
+        if not indices:
+            return []
+        vectors = self.vector_store.index.reconstruct_batch(indices)
+        return [(self.vector_store.index_to_docstore_id[i], vector) for i, vector in zip(indices, vectors)]
+
+    def vectors_for(self, doc_ids):
+        """(doc_id, vector) pairs of the given documents, read from the index by position."""
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in self.vector_store.index_to_docstore_id.items()}
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id in self._positions]
+        if not doc_ids:
+            return []
+        vectors = self.vector_store.index.reconstruct_batch([self._positions[doc_id] for doc_id in doc_ids])
+        return list(zip(doc_ids, vectors))
+
+    def exact_candidates(self, embedding, doc_ids):
+        """All of doc_ids as (doc_id, vector) pairs ordered by distance, without the ANN index."""
+        candidates = self.vectors_for(doc_ids)
+        if not candidates:
+            return []
+        distances = np.linalg.norm(np.array([vector for _, vector in candidates]) - embedding, axis=1)
+        return [candidates[i] for i in np.argsort(distances, kind="stable")]
+
+    def entity_candidates(self, query, embedding, allowed=None):
+        """
+        Documents mentioning a known name / location of the query (metadata index
+        lookup, no vector search), best first: rarer and more matched entities,
+        then similarity to the query.
+        """
+        if self.metadata_index is None:
+            return []
+        matches = self.metadata_index.match_entities(query)
+        weights = {}
+        n_docs = max(len(self.metadata_index), 1)
+        for doc_ids in matches.values():
+            idf = math.log(1 + n_docs / len(doc_ids))
+            for doc_id in doc_ids:
+                if allowed is None or doc_id in allowed:
+                    weights[doc_id] = weights.get(doc_id, 0) + idf
+        if not weights:
+            return []
+
+        ranked = sorted(weights, key=lambda doc_id: -weights[doc_id])[:MAX_ENTITY_CANDIDATES]
+        candidates = self.vectors_for(ranked)
+        similarities = np.array([vector for _, vector in candidates]) @ embedding
+        order = sorted(range(len(candidates)), key=lambda i: (-weights[candidates[i][0]], -similarities[i]))
+        return [candidates[i] for i in order]
+
+    def fuse(self, dense, entity):
+        """
+        Reciprocal rank fusion of the MMR picks (doc_id, score) and the entity
+        matches (doc_id, vector); keeps k/2 with the fused score.
+        Without entity matches the MMR picks are returned unchanged.
+        """
+        if not entity:
+            return dense
+        scores = {}
+        for ranking in ([doc_id for doc_id, _ in dense], [doc_id for doc_id, _ in entity]):
+            for rank, doc_id in enumerate(ranking):
+                scores[doc_id] = scores.get(doc_id, 0) + 1 / (self.rrf_k + rank + 1)
+        fused = sorted(scores, key=lambda doc_id: -scores[doc_id])[:self.k // 2]
+        return [(doc_id, scores[doc_id]) for doc_id in fused]
+
+    def fetch_candidates_batch(self, embeddings, fetch_k):
+        """fetch_candidates for many query embeddings with a single index search."""
+        _, indices = self.vector_store.index.search(np.ascontiguousarray(embeddings, dtype=np.float32), fetch_k)
+        flat = sorted({int(i) for i in indices.ravel() if i != -1})
+        if not flat:
+            return [[] for _ in indices]
+        vectors = dict(zip(flat, self.vector_store.index.reconstruct_batch(flat)))
+        return [
+            [(self.vector_store.index_to_docstore_id[int(i)], vectors[int(i)]) for i in row if i != -1]
+            for row in indices
+        ]
+
+    def mmr(self, embedding, candidates):
+        """MMR selection of k/2 candidates, as (doc_id, cosine similarity to the query) pairs."""
+        if not candidates:
+            return []
+        vectors = np.array([vector for _, vector in candidates], dtype=np.float32)
+        selected = maximal_marginal_relevance(
+            embedding.reshape(1, -1),
+            list(vectors),
+            k=self.k // 2,
+            lambda_mult=self.lambda_mult,
+        )
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(embedding)
+        scores = vectors @ embedding / np.where(norms == 0, 1, norms)
+        return [(candidates[i][0], float(scores[i])) for i in selected]
+
+    def fetch_topic_candidates(self, embedding, topics, fetch_k):
+        """Nearest fetch_k docs of the given topics, searched in those topics' partitions only."""
+        return self.topic_index.search_topics(topics, embedding, fetch_k)
+
+    def load_results(self, *selections):
+        """Swap doc ids for documents, reading each selected document once."""
+        doc_ids = list(dict.fromkeys(doc_id for selection in selections for doc_id, _ in selection))
+        docs = dict(zip(doc_ids, self.get_docs(doc_ids)))
+        return tuple([(docs[doc_id], score) for doc_id, score in selection] for selection in selections)
+
+    def dense_candidates(self, embedding, topics, allowed=None, pool=None, topic_pool=None):
+        """
+        The general and topic candidate pools (fetch_k each) as (doc_id, vector) pairs.
+        `allowed` (a time range) is applied by scoring the allowed documents
+        exactly when there are few of them, else by filtering an over-fetched pool.
+        `pool` is the query's nearest 2 * fetch_k and `topic_pool` its nearest
+        fetch_k across the topics' partitions, when already fetched in a batch.
+        """
+        if allowed is not None and len(allowed) <= EXACT_SEARCH_MAX:
+            pool = self.exact_candidates(embedding, list(allowed))
+            if not topics:
+                return pool[:self.k], []
+            in_topics = self.metadata_index.topic_docs(topics)
+            return pool[:self.k], [candidate for candidate in pool if candidate[0] in in_topics][:self.k]
+
+        fetch_k = self.k * (4 if allowed is not None else 1)
+        if pool is not None and allowed is None:
+            fetch = lambda n: pool[:n]
+        else:
+            fetch = lambda n: self.fetch_candidates(embedding, n)
+
+        if not topics:
+            candidates, topic_candidates = fetch(fetch_k), []
+        elif self.topic_index is not None:
+            candidates = fetch(fetch_k)
+            if topic_pool is not None and allowed is None:
+                topic_candidates = topic_pool
+            else:
+                topic_candidates = self.fetch_topic_candidates(embedding, topics, fetch_k)
+        else:
+            candidates = fetch(fetch_k * 2)
+            candidate_topics = self.get_topics([doc_id for doc_id, _ in candidates])
+            topic_candidates = [candidate for candidate, topic in zip(candidates, candidate_topics) if topic in topics]
+
+        if allowed is not None:
+            candidates = [candidate for candidate in candidates if candidate[0] in allowed]
+            topic_candidates = [candidate for candidate in topic_candidates if candidate[0] in allowed]
+        return candidates[:self.k], topic_candidates[:self.k]
+
+    def search(self, query, topics=None, embedding=None, time_range=None, pool=None, topic_pool=None):
+        """
+        Topic and general retrieval from a single query embedding.
+        `topics` is a topic name or a list of them (best first, from the topic router).
+        The general MMR runs over the nearest fetch_k docs of the global index and
+        the topic MMR over the nearest fetch_k docs across the topics' partitions,
+        so a query spanning several topics gets one diversified topic section.
+        Indexes saved without partitions fall back to filtering an over-fetched
+        (2 * fetch_k) global candidate pool.
+        With a metadata index, documents that mention a name or location of the
+        query are fused into both sections (reciprocal rank fusion).
+        time_range=(start, end) keeps only documents from that period. It is an
+        API-only filter (the chat path doesn't pass it) and needs the metadata index.
+        Pass `embedding` when the caller already embedded the query, and `pool` /
+        `topic_pool` when search_batch already fetched its candidates.
+        Candidates are handled as doc ids and vectors; documents are read from
+        the docstore only for the picked ones.
+        Returns (docs_topic, docs_general) as (doc, score) pairs, the score being
+        the cosine similarity, or the fused rank score when entities matched;
+        the two may overlap.
+        """
+        if embedding is None:
+            embedding = self.embed_query(query)
+        if isinstance(topics, str):
+            topics = [topics]
+
+        allowed = None
+        if time_range is not None:
+            if self.metadata_index is None:
+                raise ValueError("time_range needs the metadata index, rebuild the vector store to create it")
+            allowed = self.metadata_index.time_range(*time_range)
+
+        candidates, topic_candidates = self.dense_candidates(embedding, topics, allowed, pool, topic_pool)
+        entity = self.entity_candidates(query, embedding, allowed)
+        docs_general = self.fuse(self.mmr(embedding, candidates), entity)
+        if not topics:
+            docs_general, = self.load_results(docs_general)
+            return docs_general, docs_general
+
+        if entity:
+            in_topics = self.metadata_index.topic_docs(topics)
+            entity = [candidate for candidate in entity if candidate[0] in in_topics]
+        docs_topic = self.fuse(self.mmr(embedding, topic_candidates), entity)
+        return self.load_results(docs_topic, docs_general)
+
+    def search_batch(self, queries, embeddings, topics_list):
+        """
+        search() for many queries: one batched search of the global index for all
+        their candidate pools, and one batched search per topic partition for all
+        the queries routed to that topic.
+        """
+        topics_list = [[topics] if isinstance(topics, str) else topics for topics in topics_list]
+        pools = self.fetch_candidates_batch(embeddings, self.k * 2)
+        topic_pools = [None] * len(queries)
+        if self.topic_index is not None:
+            topic_pools = self.topic_index.search_topics_batch(topics_list, embeddings, self.k)
+        return [
+            self.search(query, topics, embedding, pool=pool, topic_pool=topic_pool)
+            for query, topics, embedding, pool, topic_pool in zip(queries, topics_list, embeddings, pools, topic_pools)
+        ]
@@ -0,0 +1,137 @@
+import os
+import json
+import faiss
+import numpy as np
+
+
+class TopicIndex:
+    """
+    One small FAISS index per source_topic, saved next to the global index.
+    Each partition keeps the docstore ids of its vectors, so a topic-scoped
+    query searches only that topic's vectors (full recall, cost proportional
+    to the topic size) and stays valid when the global index is compacted.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.indexes = {}
+        self.doc_ids = {}
+
+    @classmethod
+    def from_vector_store(cls, vector_store):
+        """Partition every vector of a LangChain FAISS store by its 'topic' metadata."""
+        topic_index = cls(vector_store.index.d)
+        n = vector_store.index.ntotal
+        if n == 0:
+            return topic_index
+        vectors = vector_store.index.reconstruct_n(0, n)
+        doc_ids = [vector_store.index_to_docstore_id[i] for i in range(n)]
+        if hasattr(vector_store.docstore, "topics"):
+            topics = vector_store.docstore.topics(doc_ids)
+        else:
+            topics = [vector_store.docstore.search(doc_id).metadata.get("topic") for doc_id in doc_ids]
+        topic_index.add(topics, doc_ids, vectors)
+        return topic_index
+
+    def topics(self):
+        return list(self.indexes)
+
+    def size(self, topic):
+        return len(self.doc_ids.get(topic, []))
+
+    def add(self, topics, doc_ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        by_topic = {}
+        for row, topic in enumerate(topics):
+            by_topic.setdefault(topic, []).append(row)
+
+        for topic, rows in by_topic.items():
+            if topic not in self.indexes:
+                self.indexes[topic] = faiss.IndexFlatL2(self.dim)
+                self.doc_ids[topic] = []
+            self.indexes[topic].add(vectors[rows])
+            self.doc_ids[topic].extend(doc_ids[row] for row in rows)
+
+    def delete(self, doc_ids):
+        doc_ids = set(doc_ids)
+        for topic in list(self.indexes):
+            positions = [i for i, doc_id in enumerate(self.doc_ids[topic]) if doc_id in doc_ids]
+            if not positions:
+                continue
+            # IndexFlat.remove_ids compacts in order, the same as the id list below
+            self.indexes[topic].remove_ids(np.array(positions, dtype=np.int64))
+            self.doc_ids[topic] = [doc_id for doc_id in self.doc_ids[topic] if doc_id not in doc_ids]
+            if not self.doc_ids[topic]:
+                del self.indexes[topic], self.doc_ids[topic]
+
+    def _search(self, topic, embedding, k):
+        return self._search_batch(topic, np.asarray(embedding, dtype=np.float32).reshape(1, -1), k)[0]
+
+    def _search_batch(self, topic, embeddings, k):
+        """(distance, doc_id, vector) hits of each embedding in one search of the topic's partition."""
+        if topic not in self.indexes:
+            return [[] for _ in embeddings]
+        index = self.indexes[topic]
+        distances, positions = index.search(np.ascontiguousarray(embeddings, dtype=np.float32), min(k, index.ntotal))
+        flat = sorted({int(i) for i in positions.ravel() if i != -1})
+        if not flat:
+            return [[] for _ in embeddings]
+        vectors = dict(zip(flat, index.reconstruct_batch(flat)))
+        return [
+            [(float(d), self.doc_ids[topic][int(i)], vectors[int(i)]) for d, i in zip(row_distances, row_positions) if i != -1]
+            for row_distances, row_positions in zip(distances, positions)
+        ]
+
+    def search(self, topic, embedding, k):
+        """Nearest k vectors of one topic as (doc_id, vector) pairs, ordered by distance."""
+        return [(doc_id, vector) for _, doc_id, vector in self._search(topic, embedding, k)]
+
+    def search_topics(self, topics, embedding, k):
+        """Nearest k vectors across several topics' partitions, merged by distance."""
+        return self.search_topics_batch([topics], np.asarray(embedding, dtype=np.float32).reshape(1, -1), k)[0]
+
+    def search_topics_batch(self, topics_list, embeddings, k):
+        """
+        search_topics for many queries: the queries are grouped by topic and each
+        partition is searched once with all of its queries' embeddings.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        rows_by_topic = {}
+        for row, topics in enumerate(topics_list):
+            for topic in dict.fromkeys(topics or []):
+                rows_by_topic.setdefault(topic, []).append(row)
+
+        hits = [[] for _ in topics_list]
+        for topic, rows in rows_by_topic.items():
+            for row, topic_hits in zip(rows, self._search_batch(topic, embeddings[rows], k)):
+                hits[row].extend(topic_hits)
+        return [
+            [(doc_id, vector) for _, doc_id, vector in sorted(row_hits, key=lambda hit: hit[0])[:k]]
+            for row_hits in hits
+        ]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        manifest = {}
+        for n, topic in enumerate(sorted(self.indexes, key=str)):
+            file_name = f"topic_{n}.faiss"
+            faiss.write_index(self.indexes[topic], os.path.join(path, file_name))
+            manifest[topic] = {"file": file_name, "doc_ids": self.doc_ids[topic]}
+
+        with open(os.path.join(path, "topics.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "topics": manifest}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        """Load saved partitions, or return None if the index was saved without them."""
+        manifest_path = os.path.join(path, "topics.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        topic_index = cls(manifest["dim"])
+        for topic, entry in manifest["topics"].items():
+            topic_index.indexes[topic] = faiss.read_index(os.path.join(path, entry["file"]))
+            topic_index.doc_ids[topic] = entry["doc_ids"]
+        return topic_index
@@ -0,0 +1,140 @@
+from collections import deque
+
+# One-letter Hebrew prefixes (and, the, in, to, from, that, as) that may be glued to a keyword
+HEBREW_PREFIXES = set("והבלמשכ")
+MAX_PREFIX_LETTERS = 3
+# Short keywords only take one of these; "כבר" (already) and "שבר" are not "בר"
+SHORT_KEYWORD_PREFIXES = set("הבלו")
+WORD_JOINERS = set("׳'\"-")
+
+
+def is_word_char(ch):
+    return ch.isalnum() or ch in WORD_JOINERS
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over many keywords: finds every occurrence of all
+    of them in a single pass over the text. Matching is case-insensitive.
+    A match must start a word, possibly after Hebrew prefix letters
+    (ה/ב/ל/ו..., e.g. "לאולם", "והצלם"); keywords of up to
+    `short_keyword_length` characters must also end the word and take at
+    most one prefix out of SHORT_KEYWORD_PREFIXES ("לבר", but not "כבר").
+    Longer keywords are stems ("צלם" matches "צלמים") unless whole_words is set,
+    for exact values such as names, which must end the word too.
+    """
+
+    def __init__(self, keywords, short_keyword_length=2, whole_words=False):
+        self.short_keyword_length = short_keyword_length
+        self.whole_words = whole_words
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in keywords:
+            self._add(keyword.lower())
+        self._build()
+
+    def _add(self, keyword):
+        state = 0
+        for ch in keyword:
+            if ch not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][ch] = len(self.goto) - 1
+            state = self.goto[state][ch]
+        self.output[state].append(keyword)
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    @staticmethod
+    def starts_word(text, start, prefixes=HEBREW_PREFIXES, max_prefix_letters=MAX_PREFIX_LETTERS):
+        j = start
+        while True:
+            if j == 0 or not is_word_char(text[j - 1]):
+                return True
+            if start - j >= max_prefix_letters or text[j - 1] not in prefixes:
+                return False
+            j -= 1
+
+    def find(self, text):
+        """Yield (start, end, keyword) for every valid keyword occurrence in text."""
+        text = text.lower()
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for keyword in self.output[state]:
+                start, end = i - len(keyword) + 1, i + 1
+                if len(keyword) <= self.short_keyword_length:
+                    if not self.starts_word(text, start, SHORT_KEYWORD_PREFIXES, 1):
+                        continue
+                    if end < len(text) and is_word_char(text[end]):
+                        continue
+                elif not self.starts_word(text, start):
+                    continue
+                elif self.whole_words and end < len(text) and is_word_char(text[end]):
+                    continue
+                yield start, end, keyword
+
+
+class TopicRouter:
+    """
+    Scores every topic in one pass over the query. A topic's score is the total
+    length of its distinct matched keywords, so more specific matches weigh more.
+    """
+
+    def __init__(self, topic_keywords):
+        self.keyword_topics = {}
+        for topic, keywords in topic_keywords.items():
+            for keyword in keywords:
+                self.keyword_topics.setdefault(keyword.lower(), []).append(topic)
+        self.topic_order = {topic: i for i, topic in enumerate(topic_keywords)}
+        self.matcher = KeywordMatcher(self.keyword_topics)
+
+    def scores(self, query):
+        matched = {keyword for _, _, keyword in self.matcher.find(query)}
+        scores = {}
+        for keyword in matched:
+            for topic in self.keyword_topics[keyword]:
+                scores[topic] = scores.get(topic, 0) + len(keyword)
+        return scores
+
+    def route(self, query, top_n=3):
+        """The top_n best matching topics, best first (ties keep the keyword table order)."""
+        scores = self.scores(query)
+        ranked = sorted(scores, key=lambda topic: (-scores[topic], self.topic_order[topic]))
+        return ranked[:top_n]
+
+
+if __name__ == "__main__":
+    # Regression checks: python -m RAG.TopicRouter
+    router = TopicRouter({"venue": ["אולם", "גן"], "photographer": ["צלם"], "bar": ["בר", "אלכוהול"]})
+    assert router.route("כבר הזמנו צלם") == ["photographer"]
+    assert router.route("שבר לי הלב") == []
+    assert router.route("מי עשה לכם את הבר?") == ["bar"]
+    assert router.route("צלם לבר ולאולם") == ["venue", "photographer", "bar"]
+    assert router.route("חתונה בגן") == ["venue"]
+
+    names = KeywordMatcher({"אור", "עדי", "שיר", "אבי"}, whole_words=True)
+    def found(text):
+        return {keyword for _, _, keyword in names.find(text)}
+    assert found("כמה אורחים הגיעו") == set()
+    assert found("מה עדיף") == set()
+    assert found("שירים לחופה") == set()
+    assert found("אולם בתל אביב") == set()
+    assert found("הצלם של אור ולעדי") == {"אור", "עדי"}
+    print("ok")
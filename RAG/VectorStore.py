@@ -1,18 +1,32 @@
+import os
+import json
+import uuid
 import faiss
+import threading
 import numpy as np
-import pandas as pd
 from Config import Config
+from RAG.EmbeddingCache import EmbeddingCache
+from RAG.DocStore import SQLiteDocstore
+from RAG.TopicIndex import TopicIndex
+from RAG.MetadataIndex import MetadataIndex
+from RAG.IndexFactory import create_index, train_index, tune_index, supports_removal
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
-from sentence_transformers import SentenceTransformer
-from langchain_community.docstore.in_memory import InMemoryDocstore
 
     
 class VectorStore:
+    """
+    Builds, updates and loads the FAISS index.
+    The embedding model, the embedding cache and the dataset documents are all
+    loaded on first use, so serving from a saved index only reads the index.
+    """
+
     def __init__(self):
         self.config = Config()
-        self.model = SentenceTransformer(self.config.embeded_model_name)
-        self.create_docs()
+        self._model = None
+        self._docs = None
+        self._embedding_cache = None
+        self._lock = threading.Lock()
 
         self.embedding_function = lambda texts: self.model.encode(
             texts,
@@ -20,14 +34,57 @@ class VectorStore:
             device="cpu"
         ).tolist()
 
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.config.embeded_model_name)
+            return self._model
+
+    @property
+    def docs(self):
+        if self._docs is None:
+            self.create_docs()
+        return self._docs
+
+    @property
+    def embedding_cache(self):
+        if self._embedding_cache is None:
+            self._embedding_cache = EmbeddingCache(
+                self.config.embedding_cache_path,
+                self.config.embeded_model_name,
+                self.model.get_sentence_embedding_dimension()
+            )
+        return self._embedding_cache
+
+    def warmup(self):
+        """Load the embedding model and run one query, e.g. in a background thread after startup."""
+        self.embedding_function("warmup")
+
+    def embed_queries(self, texts, batch_size=128):
+        """Embeddings of many queries in large batches (bulk answering), as a float32 matrix."""
+        vectors = self.model.encode(texts, batch_size=batch_size, device="cpu")
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+    def embed_documents(self, texts):
+        """Document embeddings, read from the on-disk cache and only computed for new texts."""
+        return self.embedding_cache.embed(texts, self.embedding_function)
+
     def create_docs(self):
-        df = pd.read_csv(self.config.dataset)
+        import pandas as pd
+        df = pd.read_csv(self.config.dataset, dtype={"doc_id": str})
+        self._docs = self.rows_to_docs(df)
 
-        self.docs = []
+    def rows_to_docs(self, df):
+        docs = []
 
-        for _, row in df.iterrows():
-            self.docs.append(
+        for row in df.to_dict("records"):
+            # Rows from older datasets have no doc_id
+            doc_id = row.get("doc_id")
+            docs.append(
                 Document(
+                    id=doc_id if isinstance(doc_id, str) else str(uuid.uuid4()),
                     page_content=f"{row['summary_text']}\n\nConversation:\n{row['original_msg']}",
                     metadata={
                         "topic": row["source_topic"],
@@ -37,23 +94,157 @@ class VectorStore:
                     }
                 )
             )
+        return docs
+
+    def docstore_path(self):
+        return os.path.join(self.config.vector_store_path, "docstore.sqlite")
+
+    def new_docstore(self):
+        """Empty SQLite docstore for the index, replacing any previous one."""
+        os.makedirs(self.config.vector_store_path, exist_ok=True)
+        if os.path.exists(self.docstore_path()):
+            os.remove(self.docstore_path())
+        return SQLiteDocstore(self.docstore_path(), self.config.docstore_mmap_mb * 2**20)
 
     def load_vector_store(self):
-        return FAISS.load_local(self.config.vector_store_path, embeddings=self.embedding_function, allow_dangerous_deserialization=True)
+        path = self.config.vector_store_path
+        if os.path.exists(self.docstore_path()):
+            index = faiss.read_index(os.path.join(path, "index.faiss"))
+            with open(os.path.join(path, "index_ids.json"), "r", encoding="utf-8") as f:
+                index_ids = json.load(f)
+            vector_store = FAISS(
+                embedding_function=self.embedding_function,
+                index=index,
+                docstore=SQLiteDocstore(self.docstore_path(), self.config.docstore_mmap_mb * 2**20),
+                index_to_docstore_id=dict(enumerate(index_ids)),
+            )
+        else:
+            # Index saved before the SQLite docstore (pickled InMemoryDocstore); the next save converts it
+            vector_store = FAISS.load_local(path, embeddings=self.embedding_function, allow_dangerous_deserialization=True)
+        tune_index(vector_store.index, self.config)
+        return vector_store
+
+    def save_vector_store(self, vector_store):
+        """Write the FAISS index and its position -> doc id list; documents live in the SQLite docstore."""
+        path = self.config.vector_store_path
+        if not isinstance(vector_store.docstore, SQLiteDocstore):
+            docstore = self.new_docstore()
+            docstore.add({doc_id: vector_store.docstore.search(doc_id) for doc_id in vector_store.index_to_docstore_id.values()})
+            vector_store.docstore = docstore
+
+        faiss.write_index(vector_store.index, os.path.join(path, "index.faiss"))
+        index_ids = [vector_store.index_to_docstore_id[i] for i in range(len(vector_store.index_to_docstore_id))]
+        with open(os.path.join(path, "index_ids.json"), "w", encoding="utf-8") as f:
+            json.dump(index_ids, f, ensure_ascii=False)
+
+        legacy_path = os.path.join(path, "index.pkl")
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def index_version(self):
+        """Id of the saved index build, changed on every rebuild/update (used to invalidate caches)."""
+        version_path = os.path.join(self.config.vector_store_path, "version.txt")
+        if os.path.exists(version_path):
+            with open(version_path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+        return str(os.path.getmtime(os.path.join(self.config.vector_store_path, "index.faiss")))
+
+    def save_version(self):
+        with open(os.path.join(self.config.vector_store_path, "version.txt"), "w", encoding="utf-8") as f:
+            f.write(uuid.uuid4().hex)
+
+    def topic_index_path(self):
+        return os.path.join(self.config.vector_store_path, "topics")
+
+    def load_topic_index(self):
+        """Per-topic partitions saved with the index (None for indexes saved without them)."""
+        return TopicIndex.load(self.topic_index_path())
+
+    def metadata_index_path(self):
+        return os.path.join(self.config.vector_store_path, "metadata.json")
+
+    def load_metadata_index(self):
+        """Names / locations / topic / time index saved with the index (None for indexes saved without it)."""
+        return MetadataIndex.load(self.metadata_index_path())
 
     def create_vector(self):
-        embedding_dim = len(self.embedding_function(["hello world"])[0])
-        index = faiss.IndexFlatL2(embedding_dim)
+        embedding_dim = self.embedding_cache.dim
+        embeddings = self.embed_documents([doc.page_content for doc in self.docs])
+
+        # Index type and its parameters come from Config (flat, hnsw, ivf_flat, ivf_pq, ivf_sq8)
+        index = create_index(self.config, embedding_dim, len(self.docs))
+        train_index(index, embeddings)
+        tune_index(index, self.config)
 
         # Create empty FAISS store
         self.vector_store = FAISS(
             embedding_function=self.embedding_function,
             index=index,
-            docstore=InMemoryDocstore(),
+            docstore=self.new_docstore(),
             index_to_docstore_id={},
         )
-        metadatas = [doc.metadata for doc in self.docs]
-        texts = [doc.page_content for doc in self.docs]
+        self.add_docs(self.vector_store, self.docs, embeddings)
+        self.save_vector_store(self.vector_store)
+
+        topic_index = TopicIndex(embedding_dim)
+        topic_index.add([doc.metadata["topic"] for doc in self.docs], [doc.id for doc in self.docs], embeddings)
+        topic_index.save(self.topic_index_path())
+        MetadataIndex.from_docs(self.docs).save(self.metadata_index_path())
+        self.save_version()
+
+        # Full rebuild: forget vectors of documents that no longer exist
+        self.embedding_cache.prune([doc.page_content for doc in self.docs])
+
+    def add_docs(self, vector_store, docs, embeddings=None):
+        metadatas = [doc.metadata for doc in docs]
+        texts = [doc.page_content for doc in docs]
+        ids = [doc.id for doc in docs]
+        if embeddings is None:
+            embeddings = self.embed_documents(texts)
+
+        vector_store.add_embeddings(text_embeddings=zip(texts, embeddings), metadatas=metadatas, ids=ids)
+        return embeddings
+
+    def update_vector(self, df, stale_ids=()):
+        """
+        Upsert the documents of `df` (by doc_id) into the saved index in place
+        and remove stale_ids, instead of rebuilding it.
+        Index types that can't remove vectors in place are rebuilt from the
+        (already updated) dataset when something has to be removed.
+        """
+        vector_store = self.load_vector_store()
+        topic_index = self.load_topic_index() or TopicIndex.from_vector_store(vector_store)
+        metadata_index = self.load_metadata_index()
+        if metadata_index is None:
+            docstore = vector_store.docstore
+            doc_ids = list(vector_store.index_to_docstore_id.values())
+            docs = docstore.mget(doc_ids) if hasattr(docstore, "mget") else [docstore.search(doc_id) for doc_id in doc_ids]
+            metadata_index = MetadataIndex.from_docs(docs)
+        docs = self.rows_to_docs(df)
+
+        existing = set(vector_store.index_to_docstore_id.values())
+        to_remove = [doc_id for doc_id in set(stale_ids) | {doc.id for doc in docs} if doc_id in existing]
+        if not to_remove and not docs:
+            # Keep the index version, so caches keyed on it stay valid
+            print("Vector store is up to date")
+            return
+        if to_remove and not supports_removal(self.config):
+            print(f"{self.config.index_type} index can't remove vectors in place, rebuilding it")
+            if isinstance(vector_store.docstore, SQLiteDocstore):
+                vector_store.docstore.close()
+            self.create_vector()
+            return
+        if to_remove:
+            vector_store.delete(to_remove)
+            topic_index.delete(to_remove)
+            metadata_index.delete(to_remove)
+        if docs:
+            embeddings = self.add_docs(vector_store, docs)
+            topic_index.add([doc.metadata["topic"] for doc in docs], [doc.id for doc in docs], embeddings)
+            metadata_index.add(docs)
 
-        self.vector_store.add_texts(texts=texts, metadatas=metadatas)
-        self.vector_store.save_local(self.config.vector_store_path)
\ No newline at end of file
+        self.save_vector_store(vector_store)
+        topic_index.save(self.topic_index_path())
+        metadata_index.save(self.metadata_index_path())
+        self.save_version()
+        print(f"Vector store updated: {len(docs)} documents upserted, {len(to_remove)} replaced or removed")
\ No newline at end of file